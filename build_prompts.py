@@ -0,0 +1,35 @@
+"""Render the prompts of datasets and strategies once into prompt packs
+
+Format: python3 build_prompts.py --dataset ... --strategy ... [--fewshot-dataset ...] [--fewshot-selection ...] [--seed ...]
+
+Every (dataset, strategy) combination is written to models/prompt_packs. Runs with --prompt-packs read their prompts
+from these packs instead of rendering them, so all models of a sweep get byte-identical prompts.
+"""
+import argparse
+from datasets.abstract_dataset_loader import DatasetLoader
+from models.prompt_generator import PromptGenerator
+from models.prompt_pack import get_prompt_pack, pack_path, DEFAULT_SEED
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the prompts of every dataset and strategy into a prompt pack.")
+    parser.add_argument('--dataset', type=str, nargs='+', help='Dataset(s) to render. Possible options: ' + ', '.join(DatasetLoader.registered_datasets) + '.', required=True)
+    parser.add_argument('--strategy', type=str, nargs='+', help="Prompting strategy or strategies to render. Possible options: " + ", ".join(PromptGenerator.registered_strategies), required=True)
+    parser.add_argument('--fewshot-dataset', type=str, help='Dataset to use to collect few-shot examples. Default: morehopqa', default="morehopqa")
+    parser.add_argument('--fewshot-selection', type=str, help='How few-shot examples are chosen. Possible options: ' + ', '.join(PromptGenerator.fewshot_selections) + '. Default: random', default="random")
+    parser.add_argument('--seed', type=int, help=f'Seed of the random state the prompts are rendered with. Default: {DEFAULT_SEED}', default=DEFAULT_SEED)
+    # Other options of run_evaluation.py, e.g. passed on by sweep.py, are ignored.
+    args, _ = parser.parse_known_args()
+
+    for strategy in args.strategy:
+        if strategy not in PromptGenerator.registered_strategies:
+            raise ValueError(f"Strategy {strategy} not found.")
+    fewshot_dataset = DatasetLoader.create(args.fewshot_dataset)
+    for dataset_name in args.dataset:
+        dataset = DatasetLoader.create(dataset_name)
+        for strategy in args.strategy:
+            pack = get_prompt_pack(dataset_name, dataset, strategy, args.fewshot_dataset, fewshot_dataset, args.fewshot_selection, args.seed, rebuild=True)
+            print(f"{pack_path(dataset_name, strategy, args.fewshot_selection, args.seed)}: {len(pack.records)} prompts, hash {pack.content_hash()[:16]}")
+
+if __name__ == '__main__':
+    main()
@@ -2,22 +2,65 @@
 Abstract dataset class to load a dataset and provide entries.
 """
 from abc import ABC, abstractmethod
+import glob
+import hashlib
+import json
+import os
+import pickle
+
+SNAPSHOT_DIR = "datasets/snapshots"
+
 
 class DatasetLoader(ABC):
     registered_datasets = ["morehopqa", "morehopqa-150"]
+    # Loaded datasets by name, shared within a process.
+    loaded_datasets = dict()
     
     @abstractmethod
     def items(self): 
         """Should iterate over data and return items"""
         pass
 
+    def load_json(self, path, snapshot_dir=SNAPSHOT_DIR):
+        """Load the entries of a JSON dataset file into self.data, together with the family and variant of every id.
+
+        The parsed entries are pickled to a snapshot named after a hash of the file contents, which later runs load
+        instead of parsing the JSON again. A changed file gets a new snapshot."""
+        with open(path, "rb") as f:
+            source = f.read()
+        name = os.path.basename(path)
+        snapshot_path = os.path.join(snapshot_dir, f"{name}.{hashlib.sha256(source).hexdigest()[:16]}.pickle")
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+        else:
+            data = json.loads(source)
+            ids = [entry["_id"].split("_") for entry in data]
+            snapshot = {"data": data, "families": ["_".join(parts[:-1]) for parts in ids], "variants": [parts[-1] for parts in ids]}
+            os.makedirs(snapshot_dir, exist_ok=True)
+            for old_snapshot in glob.glob(os.path.join(snapshot_dir, f"{name}.*.pickle")):
+                os.remove(old_snapshot)
+            temp_path = snapshot_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, snapshot_path)
+        self.data = snapshot["data"]
+        self.families = snapshot["families"]
+        self.variants = snapshot["variants"]
+        self.length = len(self.data)
+
     @staticmethod
     def create(dataset_name):
+        """Return the loaded dataset with the given name. Every dataset is only loaded once per process, so its
+        entries are shared by all users and must not be modified."""
         from datasets.morehopqa_loader import MorehopqaLoader, Morehopqa150Loader
+        if dataset_name in DatasetLoader.loaded_datasets:
+            return DatasetLoader.loaded_datasets[dataset_name]
         if dataset_name == "morehopqa":
-            return MorehopqaLoader()
+            dataset = MorehopqaLoader()
         elif dataset_name == "morehopqa-150":
-            return Morehopqa150Loader()
+            dataset = Morehopqa150Loader()
         else:
             raise ValueError(f"Dataset {dataset_name} not found.")
-        
+        DatasetLoader.loaded_datasets[dataset_name] = dataset
+        return dataset
@@ -2,7 +2,6 @@
 Load dataset based on 2wikihop dataset.
 """
 from datasets.abstract_dataset_loader import DatasetLoader
-import json
 import random
 random.seed(42)
 
@@ -11,9 +10,7 @@ class MorehopqaLoader(DatasetLoader):
 
     def __init__(self):
         super().__init__()
-        with open(self.path, "r") as f:
-            self.data = json.load(f)
-        self.length = len(self.data)
+        self.load_json(self.path)
 
     def items(self):
         for item in self.data:
@@ -25,9 +22,7 @@ class Morehopqa150Loader(DatasetLoader):
 
     def __init__(self):
         super().__init__()
-        with open(self.path, "r") as f:
-            self.data = json.load(f)
-        self.length = len(self.data)
+        self.load_json(self.path)
 
     def items(self):
         for item in self.data:
@@ -0,0 +1,134 @@
+"""
+Estimate the budget of planned runs without running them.
+Every prompt is rendered with the real prompt generator and tokenized locally, without loading model weights or
+calling an API. Output lengths are estimated from earlier cached answers of the same strategy and answer type,
+and generation time from the metrics files of earlier runs.
+"""
+import glob
+import json
+import os
+import random
+from tqdm import tqdm
+from models.abstract_model import prompt_hash
+from models.prompt_generator import PromptGenerator
+from models.generation_budget import load_answer_lengths
+
+# USD per million input and output tokens of the OpenAI models, update when prices change.
+API_PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4o": (5.00, 15.00),
+}
+# Generation budget of all backends, used as output length when there is no history at all.
+DEFAULT_OUTPUT_TOKENS = 256
+
+
+def load_output_history(model, dataset_entries, strategies):
+    """Token lengths of earlier cached answers of the given strategies, counted with the tokenizer of model.
+
+    Returns: dict mapping (model name of the cached run, strategy, answer_type) to a list of lengths."""
+    history = dict()
+    for (model_name, strategy, _, answer_type), lengths in load_answer_lengths(model.count_text_tokens, dataset_entries, strategies).items():
+        history.setdefault((model_name, strategy, answer_type), []).extend(lengths)
+    return history
+
+
+def load_seconds_per_token(results_dir="results"):
+    """Generation seconds per output token of every model, from the metrics files of earlier runs."""
+    seconds = dict()
+    tokens = dict()
+    for path in glob.glob(os.path.join(results_dir, "*.metrics.json")):
+        with open(path, "r") as f:
+            metrics = json.load(f)
+        model_name = metrics.get("run", dict()).get("model")
+        stages = metrics.get("stages", dict())
+        if model_name is None:
+            continue
+        # With concurrent requests, "generation" sums the overlapping call latencies; the wall time is "concurrent_generation".
+        seconds[model_name] = seconds.get(model_name, 0.0) + stages.get("concurrent_generation", stages.get("generation", 0.0))
+        tokens[model_name] = tokens.get(model_name, 0) + metrics["generation"]["output_tokens"]
+    return {model_name: seconds[model_name] / tokens[model_name] for model_name in seconds if tokens[model_name] > 0}
+
+
+def expected_output_tokens(history, model_name, strategy, answer_type):
+    """Mean earlier output length, preferring answers of the same model, then of any model with the same
+    strategy and answer type, then of the strategy alone.
+
+    Returns: (expected number of output tokens, source of the estimate)"""
+    candidates = [
+        ("model", [lengths for (model, s, a), lengths in history.items() if (model, s, a) == (model_name, strategy, answer_type)]),
+        ("other models", [lengths for (model, s, a), lengths in history.items() if (s, a) == (strategy, answer_type)]),
+        ("strategy", [lengths for (model, s, a), lengths in history.items() if s == strategy]),
+    ]
+    for source, length_lists in candidates:
+        lengths = [length for length_list in length_lists for length in length_list]
+        if lengths:
+            return min(sum(lengths) / len(lengths), DEFAULT_OUTPUT_TOKENS), source
+    return DEFAULT_OUTPUT_TOKENS, "budget"
+
+
+def estimate_cell(model, model_name, dataset, strategy, history, seconds_per_token=None):
+    """Render and tokenize all prompts of one run and estimate its tokens, generation hours and API cost."""
+    prompts = 0
+    input_tokens = 0
+    output_tokens = 0.0
+    sources = dict()
+    expected = dict()
+    seen = set()
+    for entry in tqdm(dataset.items(), total=dataset.length, desc=f"{model_name} {strategy}"):
+        for prompt in model.get_all_cases(entry).values():
+            if model.dedup_prompts:
+                key = prompt_hash(prompt)
+                if key in seen:
+                    continue
+                seen.add(key)
+            if entry["answer_type"] not in expected:
+                expected[entry["answer_type"]] = expected_output_tokens(history, model_name, strategy, entry["answer_type"])
+            length, source = expected[entry["answer_type"]]
+            prompts += 1
+            input_tokens += model.count_prompt_tokens(prompt)
+            output_tokens += length * model.num_samples
+            sources[source] = sources.get(source, 0) + 1
+
+    price = API_PRICES.get(model.model_name)
+    return {
+        "prompts": prompts,
+        "input_tokens": input_tokens,
+        "output_tokens": round(output_tokens),
+        "hours": output_tokens * seconds_per_token / 3600 if seconds_per_token is not None else None,
+        "usd": (input_tokens * price[0] + output_tokens * price[1]) / 1e6 if price is not None else None,
+        "estimate": max(sources, key=sources.get) if sources else "-",
+    }
+
+
+def plan_budget(model, model_name, cells, datasets, fewshot_dataset, fewshot_selection="random", seed=42):
+    """Estimate every (dataset, strategy) cell of a planned sweep for one loaded (dry-run) model.
+
+    Returns: list of rows, each a dict with model, strategy, dataset and the estimates of estimate_cell."""
+    dataset_entries = {entry["_id"]: entry for dataset in datasets.values() for entry in dataset.items()}
+    history = load_output_history(model, dataset_entries, set(strategy for _, strategy in cells))
+    seconds_per_token = load_seconds_per_token().get(model_name)
+    rows = []
+    for dataset_name, strategy in cells:
+        # Same few-shot examples as in the real run, see run_cell.
+        random.seed(seed)
+        model.prepare_run(None, PromptGenerator.create(strategy, fewshot_dataset, fewshot_selection))
+        row = {"model": model_name, "strategy": strategy, "dataset": dataset_name}
+        row.update(estimate_cell(model, model_name, datasets[dataset_name], strategy, history, seconds_per_token))
+        rows.append(row)
+    return rows
+
+
+def format_budget(rows):
+    """Format budget rows as a text grid with a total row."""
+    def number(value, digits=0):
+        return "-" if value is None else f"{value:,.{digits}f}"
+
+    header = ["model", "strategy", "dataset", "prompts", "input_tokens", "output_tokens", "gen_hours", "api_usd", "output_estimate"]
+    lines = [[row["model"], row["strategy"], row["dataset"], number(row["prompts"]), number(row["input_tokens"]), number(row["output_tokens"]),
+              number(row["hours"], 2), number(row["usd"], 2), row["estimate"]] for row in rows]
+    total = lambda key: sum(row[key] for row in rows) if all(row[key] is not None for row in rows) else None
+    lines.append(["total", "", "", number(total("prompts")), number(total("input_tokens")), number(total("output_tokens")),
+                  number(total("hours"), 2), number(total("usd"), 2), ""])
+    widths = [max(len(cells[i]) for cells in [header] + lines) for i in range(len(header))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(cells, widths)) for cells in [header] + lines)
@@ -82,20 +82,31 @@ def evaluate(answer):
     return results
 
 
+def evaluate_entry_baseline(entry):
+    """Score a postprocessed baseline entry. Ignores cases 3 to 6."""
+    result_entry = deepcopy(entry)
+    result_entry["_id"] = entry["_id"]
+    for case_id in ["case_1", "case_2"]:
+        model_answer_text = entry[case_id + "_pred_extr"]
+        ground_truth_answer_text = entry[case_id + "_ground_truth"]
+        result_entry[case_id + "_em"] = exact_match_score(model_answer_text, ground_truth_answer_text)
+        result_entry[case_id + "_f1"], result_entry[case_id + "_precision"], result_entry[case_id + "_recall"] = f1_score(model_answer_text, ground_truth_answer_text)
+    return result_entry
+
+
+def evaluate_entry(entry):
+    """Score a postprocessed entry on all cases."""
+    result_entry = deepcopy(entry)
+    result_entry.update(evaluate(result_entry))
+    return result_entry
+
+
 def evaluate_baseline(answers: dict):
     """Evaluate the baseline model. Ignores cases 3 to 6."""
     res = dict()
-    total_answers = 0
     data = answers.values()
     for entry in tqdm(data, total=len(answers)):
-        result_entry = deepcopy(entry)
-        total_answers += 1
-        result_entry["_id"] = entry["_id"]
-        for case_id in ["case_1", "case_2"]:
-            model_answer_text = entry[case_id + "_pred_extr"]
-            ground_truth_answer_text = entry[case_id + "_ground_truth"]
-            result_entry[case_id + "_em"] = exact_match_score(model_answer_text, ground_truth_answer_text)
-            result_entry[case_id + "_f1"], result_entry[case_id + "_precision"], result_entry[case_id + "_recall"] = f1_score(model_answer_text, ground_truth_answer_text)
+        result_entry = evaluate_entry_baseline(entry)
         res[result_entry["_id"]] = result_entry
     return res
 
@@ -103,10 +114,7 @@ def evaluate_baseline(answers: dict):
 def evaluate_all(answers: dict):
     """Evaluate all answers from the model and compare them to the ground truth."""
     res = dict()
-    total_answers = 0
     for entry in tqdm(answers.values(), total=len(answers)):
-        result_entry = deepcopy(entry)
-        total_answers += 1
-        result_entry.update(evaluate(result_entry))
+        result_entry = evaluate_entry(entry)
         res[result_entry["_id"]] = result_entry
     return res
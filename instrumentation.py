@@ -0,0 +1,159 @@
+"""
+Instrumentation for evaluation runs.
+Records wall time per stage, latency and token counts of every generate/API call,
+and writes a machine-readable report next to the results file.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def percentile(values, q):
+    """Return the q-th percentile (0-100) of values, interpolating linearly between ranks."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize_calls(calls, seconds=None):
+    """Aggregate a list of call records into totals and latency percentiles.
+    Throughput is computed over seconds, the wall time of generation, if given. Otherwise the latencies are summed,
+    which undercounts throughput when calls overlap or share a batch."""
+    latencies = [call["latency"] for call in calls]
+    input_tokens = sum(call["input_tokens"] for call in calls)
+    output_tokens = sum(call["output_tokens"] for call in calls)
+    total_latency = sum(latencies)
+    summary = {
+        "calls": len(calls),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "latency_total": total_latency,
+        "latency_mean": total_latency / len(calls) if calls else 0.0,
+        "latency_max": max(latencies) if latencies else 0.0,
+    }
+    if seconds is not None:
+        summary["seconds"] = seconds
+    elapsed = seconds if seconds is not None else total_latency
+    summary["output_tokens_per_second"] = output_tokens / elapsed if elapsed > 0 else 0.0
+    for q in PERCENTILES:
+        summary[f"latency_p{q}"] = percentile(latencies, q)
+    return summary
+
+
+class Instrumentation:
+    """Collects stage timings and per-call statistics of a run.
+
+    Stages are accumulated, so a stage entered once per entry (e.g. prompt generation)
+    reports its total time. Calls are recorded with `call`, and the model wrapper reports
+    the token counts of the running call with `count_tokens`."""
+
+    def __init__(self):
+        self.stage_times = dict()
+        self.counters = dict()
+        self.calls = []
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stage_times[name] = self.stage_times.get(name, 0.0) + elapsed
+
+    def count(self, name, value=1):
+        """Add to a named counter, e.g. the number of deduplicated prompts."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def call(self, _id, case_id):
+        """Time one generate/API call for the given entry and case."""
+        record = {"_id": _id, "case": case_id, "input_tokens": 0, "output_tokens": 0, "latency": 0.0}
+        self._local.record = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            record["latency"] = elapsed
+            self._local.record = None
+            with self._lock:
+                self.calls.append(record)
+                self.stage_times["generation"] = self.stage_times.get("generation", 0.0) + elapsed
+
+    def record_call(self, _id, case_id, latency, input_tokens, output_tokens):
+        """Record a call that was timed by the caller, e.g. one prompt of a batched generate call.
+        Unlike `call`, this does not add to the generation stage time."""
+        with self._lock:
+            self.calls.append({"_id": _id, "case": case_id, "input_tokens": int(input_tokens), "output_tokens": int(output_tokens), "latency": latency})
+
+    def count_tokens(self, input_tokens, output_tokens):
+        """Add token counts to the call running in the current thread, if any."""
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record["input_tokens"] += int(input_tokens)
+            record["output_tokens"] += int(output_tokens)
+
+    def generation_seconds(self):
+        """Wall time of generation. Concurrent calls add their overlapping latencies to the generation stage,
+        so their wall time is the concurrent_generation stage."""
+        return self.stage_times.get("concurrent_generation", self.stage_times.get("generation", 0.0))
+
+    def summary(self):
+        cases = dict()
+        for call in self.calls:
+            cases.setdefault(call["case"], []).append(call)
+        return {
+            "started_at": self.started_at,
+            "wall_time": time.time() - self.started_at,
+            "stages": dict(self.stage_times),
+            "counters": dict(self.counters),
+            "generation": summarize_calls(self.calls, self.generation_seconds()),
+            "cases": {case_id: summarize_calls(case_calls) for case_id, case_calls in sorted(cases.items())},
+        }
+
+    def write_json(self, path, run_info=None):
+        report = {"run": run_info or dict()}
+        report.update(self.summary())
+        report["calls"] = self.calls
+        with open(path, "w") as f:
+            json.dump(report, f, indent=4)
+
+    def write_prometheus(self, path, labels=None):
+        """Write the summary in the Prometheus textfile collector format."""
+        label_str = ",".join(f'{key}="{value}"' for key, value in sorted((labels or dict()).items()))
+        summary = self.summary()
+
+        def metric_line(name, value, extra_labels=""):
+            all_labels = ",".join(label for label in [label_str, extra_labels] if label)
+            return f"morehopqa_{name}{{{all_labels}}} {value}"
+
+        lines = ["# TYPE morehopqa_stage_seconds gauge"]
+        for stage_name, seconds in sorted(summary["stages"].items()):
+            lines.append(metric_line("stage_seconds", seconds, f'stage="{stage_name}"'))
+        lines.append("# TYPE morehopqa_generate_latency_seconds summary")
+        for q in PERCENTILES:
+            lines.append(metric_line("generate_latency_seconds", summary["generation"][f"latency_p{q}"], f'quantile="{q / 100}"'))
+        lines.append(metric_line("generate_latency_seconds_sum", summary["generation"]["latency_total"]))
+        lines.append(metric_line("generate_latency_seconds_count", summary["generation"]["calls"]))
+        lines.append("# TYPE morehopqa_events_total counter")
+        for counter_name, value in sorted(summary["counters"].items()):
+            lines.append(metric_line("events_total", value, f'event="{counter_name}"'))
+        lines.append("# TYPE morehopqa_tokens_total counter")
+        for case_id, case_summary in summary["cases"].items():
+            lines.append(metric_line("tokens_total", case_summary["input_tokens"], f'case="{case_id}",direction="input"'))
+            lines.append(metric_line("tokens_total", case_summary["output_tokens"], f'case="{case_id}",direction="output"'))
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
@@ -6,38 +6,198 @@ Important: Cache all model answers.
 
 from abc import ABC, abstractmethod
 from datetime import datetime
+import hashlib
+import json
+import os
+
+
+def prompt_hash(prompt):
+    """Hash of a rendered prompt, either a string or a list of chat messages."""
+    return hashlib.sha256(json.dumps(prompt, ensure_ascii=False).encode("utf-8")).hexdigest()
 
 
 class AbstractModel(ABC):
-    registered_models = ["gpt-3.5-turbo-direct", "gpt-4-turbo-direct", "gpt-4o-direct", "gemma-7b", "llama-8b", "llama-70b", "mistral-7b", "baseline"]
+    registered_models = ["gpt-3.5-turbo-direct", "gpt-4-turbo-direct", "gpt-4o-direct", "openai-compatible", "gemma-7b", "llama-8b", "llama-70b", "llama-70b-assisted", "mistral-7b", "baseline"]
+    # Cases a wrapper does not ask, cached with empty prompt and answer.
+    empty_cases = []
+    # Generate identical prompts of a run only once and reuse the answer.
+    dedup_prompts = False
+    # Answers sampled per prompt; with more than one, the answer of every case is a list.
+    num_samples = 1
+    # Maximum number of tokens generated per prompt, unless a generation budget sets a lower one per case.
+    max_new_tokens = 256
+    generation_budget = None
+    # Prompts of the run rendered in advance, see models/prompt_pack.py.
+    prompt_pack = None
+    # Send prompts with a shared prefix one after another, for the prefix cache of the API or server.
+    orders_by_prefix = True
 
     @abstractmethod
-    def get_answers_and_cache(self, dataset) -> dict:
+    def get_answers_and_cache(self, dataset, on_answer=None) -> dict:
         """Should iterate over dataset and cache all answers.
+        If given, on_answer is called with every answer entry as soon as all its cases are answered.
         
         Returns: dict of answers (key: id in initial dataset, value: model_answer)"""
         pass
 
+    def format_prompt(self, prompt):
+        """Wrap a prompt of the prompt generator for the model, e.g. in its chat template."""
+        return prompt
+
+    def get_prompt(self, question_entry, context, question):
+        return self.format_prompt(self.prompt_generator.get_prompt(question_entry, context, question))
+
+    def get_all_cases(self, entry):
+        """Prompts of all cases of an entry, taken from the prompt pack of the run if there is one."""
+        if self.prompt_pack is not None:
+            prompts = self.prompt_pack.get_cases(entry["_id"])
+        else:
+            prompts = self.prompt_generator.get_case_prompts(entry)
+        return {case_id: self.format_prompt(prompt) for case_id, prompt in prompts.items()}
+
+    def get_max_new_tokens(self, entry, case_id):
+        """Number of tokens to generate for a case of an entry."""
+        if self.generation_budget is None:
+            return self.max_new_tokens
+        return self.generation_budget.get(case_id, entry["answer_type"])
+
+    def get_group_max_new_tokens(self, members, entries_by_id):
+        """Number of tokens to generate for a group of identical prompts: the largest budget of its members
+        (e.g. siblings with different answer types), so no member is cut off below its own budget."""
+        return max(self.get_max_new_tokens(entries_by_id[_id], case_id) for _id, case_id in members)
+
+    def record_truncation(self, max_new_tokens):
+        """Count an answer that was cut off at max_new_tokens. Cuts below the default maximum are caused by the generation budget."""
+        self.instrumentation.count("truncated_answers")
+        if max_new_tokens < self.max_new_tokens:
+            self.instrumentation.count("budget_truncated_answers")
+
+    def count_prompt_tokens(self, prompt):
+        """Number of input tokens of a rendered prompt, counted locally."""
+        raise NotImplementedError
+
+    def count_text_tokens(self, text):
+        """Number of tokens of a generated answer text, counted locally."""
+        raise NotImplementedError
+
+    def collect_answers(self, entries, all_cases, generated):
+        """Build answer entries in dataset and case order for all entries whose cases are all generated."""
+        answers = dict()
+        for entry in entries:
+            cases = all_cases[entry["_id"]]
+            if not all((entry["_id"], case_id) in generated for case_id in cases.keys()):
+                continue
+            answer_entry = dict()
+            answer_entry["_id"] = entry["_id"]
+            answer_entry["context"] = entry["context"]
+            for case_id, prompt in cases.items():
+                answer_entry[f"{case_id}_prompt"] = prompt
+                answer_entry[f"{case_id}_answer"] = generated[(entry["_id"], case_id)]
+            for case_id in self.empty_cases:
+                answer_entry[f"{case_id}_prompt"] = ""
+                answer_entry[f"{case_id}_answer"] = ""
+            answers[entry["_id"]] = answer_entry
+        return answers
+
+    def group_prompts(self, all_cases):
+        """Group the prompts of all entries for generation.
+
+        Returns: dict mapping the (_id, case_id) of the first occurrence of each unique prompt to all (_id, case_id)
+        with that prompt. Without prompt deduplication, every prompt is its own group."""
+        groups = dict()
+        first_keys = dict()
+        for _id, cases in all_cases.items():
+            for case_id, prompt in cases.items():
+                prompt_key = prompt_hash(prompt) if self.dedup_prompts else (_id, case_id)
+                if prompt_key not in first_keys:
+                    first_keys[prompt_key] = (_id, case_id)
+                    groups[(_id, case_id)] = []
+                groups[first_keys[prompt_key]].append((_id, case_id))
+        if self.dedup_prompts:
+            self.report_dedup(sum(len(members) for members in groups.values()), len(groups))
+        if self.orders_by_prefix and getattr(self.prompt_generator, "shares_prefixes", False):
+            groups = self.order_by_prefix(groups, all_cases)
+        return groups
+
+    def order_by_prefix(self, groups, all_cases):
+        """Order prompt groups by their prompt text, so prompts with the same prefix (e.g. the same few-shot examples)
+        are sent one after another while the prefix is cached. Counts the tokens every prompt shares with the one before,
+        which a prefix cache can reuse. In sorted order, no earlier prompt shares a longer prefix."""
+        texts = {key: prompt if isinstance(prompt, str) else json.dumps(prompt, ensure_ascii=False) for key, prompt in ((key, all_cases[key[0]][key[1]]) for key in groups.keys())}
+        ordered = sorted(groups.keys(), key=lambda key: texts[key])
+        previous = ""
+        for key in ordered:
+            shared = os.path.commonprefix([previous, texts[key]])
+            self.instrumentation.count("prefix_prompt_tokens", self.count_text_tokens(texts[key]))
+            self.instrumentation.count("prefix_shared_tokens", self.count_text_tokens(shared) if shared else 0)
+            previous = texts[key]
+        return {key: groups[key] for key in ordered}
+
+    def report_prefix_sharing(self):
+        counters = self.instrumentation.counters
+        if counters.get("prefix_prompt_tokens", 0) > 0:
+            ratio = counters["prefix_shared_tokens"] / counters["prefix_prompt_tokens"]
+            print(f"Prompt prefixes: {counters['prefix_shared_tokens']} of {counters['prefix_prompt_tokens']} prompt tokens ({ratio:.1%}) repeat the start of the previous prompt.")
+        if "cached_input_tokens" in counters:
+            input_tokens = self.instrumentation.summary()["generation"]["input_tokens"]
+            hit_rate = counters["cached_input_tokens"] / input_tokens if input_tokens else 0.0
+            print(f"Prefix cache: {counters['cached_input_tokens']} of {input_tokens} input tokens ({hit_rate:.1%}) were served from the cache.")
+
+    def get_answer_deduplicated(self, _id, case_id, prompt, answered, max_new_tokens=None):
+        """Answer a prompt of a sequential run. With prompt deduplication, the answer of an identical
+        earlier prompt with the same generation budget in answered (dict of (prompt hash, budget) -> answer) is reused
+        instead of generating again."""
+        max_new_tokens = max_new_tokens if max_new_tokens is not None else self.max_new_tokens
+        prompt_key = (prompt_hash(prompt), max_new_tokens) if self.dedup_prompts else None
+        if prompt_key in answered:
+            return answered[prompt_key]
+        with self.instrumentation.call(_id, case_id):
+            answer = self.get_answer(prompt, max_new_tokens)
+        if prompt_key is not None:
+            answered[prompt_key] = answer
+        return answer
+
+    def report_dedup(self, total_prompts, unique_prompts):
+        self.instrumentation.count("prompts", total_prompts)
+        self.instrumentation.count("unique_prompts", unique_prompts)
+        ratio = 1 - unique_prompts / total_prompts if total_prompts else 0.0
+        print(f"Prompt deduplication: {unique_prompts} unique of {total_prompts} prompts, {ratio:.1%} of generation calls saved.")
+
+    def prepare_run(self, output_file_name, prompt_generator, instrumentation=None, generation_budget=None, prompt_pack=None):
+        """Reuse the loaded model for another run.
+        Answers are cached to models/cached_answers/output_file_name and prompts are built with prompt_generator,
+        or taken from prompt_pack if given. If given, generation_budget sets the number of new tokens per case and answer type."""
+        self.output_file_name = output_file_name
+        self.prompt_generator = prompt_generator
+        self.generation_budget = generation_budget
+        self.prompt_pack = prompt_pack
+        if instrumentation is not None:
+            self.instrumentation = instrumentation
+
     @staticmethod
-    def create(model_name, output_file_name, prompt_generator):
+    def create(model_name, output_file_name, prompt_generator, instrumentation=None, **model_kwargs):
+        """Create a registered model. Additional keyword arguments are passed on to the model wrapper."""
         import models.openai_direct_model   
-        import models.openai_batch_model    
+        import models.openai_compatible_model
         import models.gemma_7b
         import models.llama_8b
         import models.mistral_7b
         import models.llama_70b
+        import models.llama_70b_assisted
         import models.baseline
         registered_models = {
         "gpt-3.5-turbo-direct": models.openai_direct_model.OpenAIDirectModel,
         "gpt-4-turbo-direct": models.openai_direct_model.OpenAIDirectModel,
         "gpt-4o-direct": models.openai_direct_model.OpenAIDirectModel,
+        "openai-compatible": models.openai_compatible_model.OpenAICompatibleModel,
         "gemma-7b": models.gemma_7b.Gemma7B,
         "llama-8b": models.llama_8b.Llama8b,
         "llama-70b": models.llama_70b.Llama70b,
+        "llama-70b-assisted": models.llama_70b_assisted.Llama70bAssisted,
         "mistral-7b": models.mistral_7b.Mistral7B,
         "baseline": models.baseline.Baseline
     }
         if model_name in registered_models:
-            return registered_models[model_name](model_name=model_name, output_file_name=f"{output_file_name}_{model_name}_{datetime.now().strftime('%y%m%d-%H%M%S')}.json", prompt_generator=prompt_generator)
+            return registered_models[model_name](model_name=model_name, output_file_name=f"{output_file_name}_{model_name}_{datetime.now().strftime('%y%m%d-%H%M%S')}.json", prompt_generator=prompt_generator, instrumentation=instrumentation, **model_kwargs)
         
         raise ValueError(f"Model {model_name} not found.")
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+TF-IDF index over the questions of a few-shot dataset, to select the examples most similar to a question.
+The matrix is built once per few-shot dataset and saved to disk, keyed by a hash of the indexed fields.
+"""
+import hashlib
+import json
+import os
+import re
+import numpy as np
+
+FEWSHOT_INDEX_DIR = "models/fewshot_index"
+
+
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def family_and_variant(_id):
+    """Split an id like <family>_<variant> into the id of its question family and the variant of the question."""
+    parts = _id.split("_")
+    return "_".join(parts[:-1]), parts[-1]
+
+
+class FewShotIndex:
+    def __init__(self, dataset, directory=FEWSHOT_INDEX_DIR):
+        self.entries = list(dataset.items())
+        fields = [[entry["_id"], entry["question"], entry["answer_type"], entry["previous_answer_type"]] for entry in self.entries]
+        key = hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(directory, f"{key}.npz")
+        if os.path.exists(path):
+            arrays = np.load(path)
+        else:
+            arrays = self.build(fields)
+            os.makedirs(directory, exist_ok=True)
+            np.savez(path, **arrays)
+        self.matrix = arrays["matrix"]
+        self.idf = arrays["idf"]
+        self.vocabulary = {word: i for i, word in enumerate(arrays["vocabulary"].tolist())}
+        self.answer_types = arrays["answer_types"]
+        self.previous_answer_types = arrays["previous_answer_types"]
+        self.families = arrays["families"]
+        self.variants = arrays["variants"]
+        self._nearest = dict()
+
+    @staticmethod
+    def build(fields):
+        """Compute the L2-normalized TF-IDF matrix of the questions (one row per entry) and the arrays used for filtering."""
+        documents = [tokenize(question) for _, question, _, _ in fields]
+        vocabulary = sorted(set(word for document in documents for word in document))
+        word_ids = {word: i for i, word in enumerate(vocabulary)}
+        counts = np.zeros((len(documents), len(vocabulary)), dtype=np.float32)
+        for row, document in enumerate(documents):
+            for word in document:
+                counts[row, word_ids[word]] += 1
+        document_frequency = (counts > 0).sum(axis=0)
+        idf = (np.log((1 + len(documents)) / (1 + document_frequency)) + 1).astype(np.float32)
+        matrix = counts * idf
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        ids = [family_and_variant(_id) for _id, _, _, _ in fields]
+        return {
+            "matrix": matrix,
+            "idf": idf,
+            "vocabulary": np.array(vocabulary, dtype=str),
+            "answer_types": np.array([answer_type for _, _, answer_type, _ in fields], dtype=str),
+            "previous_answer_types": np.array([previous_answer_type for _, _, _, previous_answer_type in fields], dtype=str),
+            "families": np.array([family for family, _ in ids], dtype=str),
+            "variants": np.array([variant for _, variant in ids], dtype=str),
+        }
+
+    def vectorize(self, text):
+        vector = np.zeros(len(self.idf), dtype=np.float32)
+        for word in tokenize(text):
+            if word in self.vocabulary:
+                vector[self.vocabulary[word]] += 1
+        vector *= self.idf
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def nearest(self, question_entry, question, k):
+        """The k entries whose questions are most similar to question, the question of question_entry that is asked
+        (e.g. a subquestion), most similar first.
+        Like the random selection, candidates must have the same answer types and come from another question family
+        and another variant. If there are fewer than k candidates, all of them are returned."""
+        key = (question_entry["_id"], question)
+        if key in self._nearest:
+            return self._nearest[key]
+        family, variant = family_and_variant(question_entry["_id"])
+        possible = (self.answer_types == question_entry["answer_type"]) & (self.previous_answer_types == question_entry["previous_answer_type"]) & (self.families != family) & (self.variants != variant)
+        scores = np.where(possible, self.matrix @ self.vectorize(question), -np.inf)
+        k = min(k, int(possible.sum()))
+        top = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.zeros(0, dtype=int)
+        # Sort by decreasing score, ties by dataset order, so the selection does not depend on argpartition.
+        top = sorted(top.tolist(), key=lambda i: (-scores[i], i))
+        self._nearest[key] = [self.entries[i] for i in top]
+        return self._nearest[key]
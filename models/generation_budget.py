@@ -0,0 +1,62 @@
+"""
+Generation budgets derived from earlier answers.
+Instead of generating up to the fixed maximum for every prompt, the number of new tokens of a case is set to a high
+percentile of the lengths of earlier answers of the same model and strategy to that case and answer type, plus a margin.
+"""
+import glob
+import json
+import os
+from instrumentation import percentile
+from results_names import parse_results_name
+
+CACHED_ANSWERS_DIR = "models/cached_answers"
+
+
+def load_answer_lengths(count_tokens, dataset_entries, strategies, model_name=None, cache_dir=CACHED_ANSWERS_DIR):
+    """Token lengths of earlier cached answers of the given strategies (and model, if given), counted with count_tokens.
+
+    Returns: dict mapping (model name of the cached run, strategy, case_id, answer_type) to a list of lengths."""
+    lengths = dict()
+    for path in sorted(glob.glob(os.path.join(cache_dir, "*.json"))):
+        name_parts = parse_results_name(path)
+        if name_parts is None or name_parts["strategy"] not in strategies:
+            continue
+        if model_name is not None and name_parts["model"] != model_name:
+            continue
+        with open(path, "r") as f:
+            answers = json.load(f)
+        for _id, answer_entry in answers.items():
+            if _id not in dataset_entries:
+                continue
+            for field, answer in answer_entry.items():
+                if not field.endswith("_answer"):
+                    continue
+                key = (name_parts["model"], name_parts["strategy"], field[:-len("_answer")], dataset_entries[_id]["answer_type"])
+                for sample in answer if isinstance(answer, list) else [answer]:
+                    if sample:
+                        lengths.setdefault(key, []).append(count_tokens(sample))
+    return lengths
+
+
+class GenerationBudget:
+    def __init__(self, budgets, default):
+        # Maps (case_id, answer_type) to the number of new tokens; other cases get the default.
+        self.budgets = budgets
+        self.default = default
+
+    @staticmethod
+    def from_cached_answers(model, model_name, strategy, dataset_entries, default, quantile=99, margin=1.2, min_answers=30):
+        """Budget of one model and strategy from its cached answers, as the given percentile of the answer lengths
+        times margin. Cases with fewer than min_answers earlier answers keep the default. No budget exceeds the default."""
+        lengths = load_answer_lengths(model.count_text_tokens, dataset_entries, [strategy], model_name)
+        budgets = dict()
+        for (_, _, case_id, answer_type), case_lengths in lengths.items():
+            if len(case_lengths) >= min_answers:
+                budgets[(case_id, answer_type)] = min(int(percentile(case_lengths, quantile) * margin) + 1, default)
+        return GenerationBudget(budgets, default)
+
+    def get(self, case_id, answer_type):
+        return self.budgets.get((case_id, answer_type), self.default)
+
+    def to_dict(self):
+        return {f"{case_id}/{answer_type}": budget for (case_id, answer_type), budget in sorted(self.budgets.items())}
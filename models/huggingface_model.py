@@ -0,0 +1,248 @@
+"""
+Shared logic of the wrappers for local Hugging Face models.
+Subclasses set the model path and implement how prompts are built, tokenized and decoded.
+"""
+
+from models.abstract_model import AbstractModel
+from models.scheduler import bucket_by_length, padding_ratio
+from models.token_cache import TokenCache
+from instrumentation import Instrumentation
+from transformers import AutoTokenizer, AutoModelForCausalLM
+from tqdm import tqdm
+import json
+import time
+import numpy as np
+import torch
+
+MAX_NEW_TOKENS = 256
+
+
+def load_causal_lm(model_path, device="cuda", device_map="cuda", quantize=None, threads=None):
+    """Load a causal language model for the given device.
+
+    On cuda, weights are loaded in bf16 with the given device map.
+    On cpu, safetensors weights are memory-mapped and loaded in fp32, the number of intra-op threads
+    is set if given, and with quantize="int8" all linear layers are dynamically quantized to int8."""
+    if device == "cuda":
+        if quantize is not None:
+            raise ValueError("Quantization is only supported on cpu.")
+        return AutoModelForCausalLM.from_pretrained(model_path, device_map=device_map, torch_dtype=torch.bfloat16)
+    if device != "cpu":
+        raise ValueError(f"Device {device} not supported. Possible options: cuda, cpu.")
+
+    if threads is not None:
+        torch.set_num_threads(threads)
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32, use_safetensors=True, low_cpu_mem_usage=True)
+    model.eval()
+    if quantize == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif quantize is not None:
+        raise ValueError(f"Quantization {quantize} not supported. Possible options: int8.")
+    return model
+
+
+class HuggingFaceModel(AbstractModel):
+    model_path = None
+    device_map = "cuda"
+    max_new_tokens = MAX_NEW_TOKENS
+    # generate keeps no prefix cache across calls, and batches are ordered by length.
+    orders_by_prefix = False
+
+    def __init__(self, model_name, output_file_name="output", prompt_generator=None, instrumentation=None, max_batch_tokens=None, device="cuda", quantize=None, threads=None, token_cache=False, dedup_prompts=False, greedy=False, model_path=None, num_samples=1, dry_run=False):
+        if greedy and num_samples > 1:
+            raise ValueError("Several samples per prompt need sampling, --greedy and --num-samples cannot be combined.")
+        if model_path is not None:
+            # E.g. a small model with the same chat format, to check a pipeline on cpu.
+            self.model_path = model_path
+        self.device = device
+        # A dry run only renders and tokenizes prompts, from a tokenizer that is already downloaded.
+        self.model = load_causal_lm(self.model_path, device, self.device_map, quantize, threads) if not dry_run else None
+        self.model_name = model_name
+        self.output_file_name =  output_file_name
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, local_files_only=dry_run)
+        self.prompt_generator = prompt_generator
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.max_batch_tokens = max_batch_tokens
+        self.token_cache = TokenCache(self.tokenizer) if token_cache else None
+        self.dedup_prompts = dedup_prompts
+        self.do_sample = not greedy
+        self.num_samples = num_samples
+
+    def format_prompt(self, prompt):
+        raise NotImplementedError
+
+    def tokenize_prompt(self, prompt):
+        """Return the input token ids of a prompt as a list."""
+        raise NotImplementedError
+
+    def get_token_ids(self, prompt):
+        """Return the input token ids of a prompt as an array, from the token cache if enabled."""
+        if self.token_cache is not None:
+            return self.token_cache.get(prompt, self.tokenize_prompt)
+        return np.asarray(self.tokenize_prompt(prompt), dtype=np.int32)
+
+    def get_input_ids(self, prompt):
+        """Return the input ids of a single prompt as a batch of one on the model device."""
+        return torch.from_numpy(self.get_token_ids(prompt).astype(np.int64)).unsqueeze(0).to(self.model.device)
+
+    def count_prompt_tokens(self, prompt):
+        return len(self.get_token_ids(prompt))
+
+    def count_text_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def save_token_cache(self):
+        if self.token_cache is not None:
+            self.token_cache.save()
+            print(f"Token cache: {self.token_cache.hits} prompts reused, {self.token_cache.misses} tokenized.")
+
+    def decode_response(self, response):
+        """Return the answer text of the generated token ids."""
+        return self.tokenizer.decode(response, skip_special_tokens=True)
+
+    def get_terminators(self):
+        return [self.tokenizer.eos_token_id]
+
+    def sampling_kwargs(self):
+        """Generate arguments for sampling, with num_samples completions per prompt from one generate call."""
+        if self.num_samples > 1:
+            return {"do_sample": True, "num_return_sequences": self.num_samples}
+        return {"do_sample": self.do_sample}
+
+    def combine_samples(self, samples):
+        """Return the answer text, or the list of all sampled answers if num_samples > 1."""
+        return samples if self.num_samples > 1 else samples[0]
+
+    def trim_responses(self, responses, terminators):
+        """Cut every list of generated token ids after its first terminator.
+        Finished sequences are padded up to the longest one of a generate call."""
+        trimmed = []
+        for response in responses:
+            length = len(response)
+            for i, token_id in enumerate(response):
+                if token_id in terminators:
+                    length = i + 1
+                    break
+            trimmed.append(response[:length])
+        return trimmed
+
+    def count_truncations(self, responses, terminators, max_new_tokens):
+        """Record every trimmed response that reached max_new_tokens without a terminator."""
+        for response in responses:
+            if len(response) >= max_new_tokens and response[-1] not in terminators:
+                self.record_truncation(max_new_tokens)
+
+    def get_answer(self, prompt, max_new_tokens=MAX_NEW_TOKENS):
+        input_ids = self.get_input_ids(prompt)
+        terminators = self.get_terminators()
+        outputs = self.model.generate(input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=max_new_tokens, eos_token_id=terminators, **self.sampling_kwargs())
+        responses = self.trim_responses(outputs[:, input_ids.shape[-1]:].tolist(), terminators)
+        self.count_truncations(responses, terminators, max_new_tokens)
+        self.instrumentation.count_tokens(input_ids.shape[-1], sum(len(response) for response in responses))
+        return self.combine_samples([self.decode_response(response) for response in responses])
+
+    def get_answers_batch(self, batch_token_ids, max_new_tokens=MAX_NEW_TOKENS):
+        """Generate answers for a batch of tokenized prompts in one generate call.
+
+        Prompts are padded on the left, so all generated tokens start at the same position.
+        Returns: list of (answer, number of generated tokens), in the order of the input.
+        With num_samples > 1, every answer is the list of its samples and the token count is their sum."""
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        longest = max(len(token_ids) for token_ids in batch_token_ids)
+        input_ids = np.full((len(batch_token_ids), longest), pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(batch_token_ids), longest), dtype=np.int64)
+        for i, token_ids in enumerate(batch_token_ids):
+            input_ids[i, longest - len(token_ids):] = token_ids
+            attention_mask[i, longest - len(token_ids):] = 1
+        input_ids = torch.from_numpy(input_ids).to(self.model.device)
+        attention_mask = torch.from_numpy(attention_mask).to(self.model.device)
+        terminators = self.get_terminators()
+        outputs = self.model.generate(input_ids=input_ids, attention_mask=attention_mask, max_new_tokens=max_new_tokens, eos_token_id=terminators, pad_token_id=pad_token_id, **self.sampling_kwargs())
+
+        # The samples of one prompt are consecutive rows of the output.
+        responses = self.trim_responses(outputs[:, longest:].tolist(), terminators)
+        self.count_truncations(responses, terminators, max_new_tokens)
+        answers = []
+        for i in range(len(batch_token_ids)):
+            samples = responses[i * self.num_samples:(i + 1) * self.num_samples]
+            answers.append((self.combine_samples([self.decode_response(response) for response in samples]), sum(len(response) for response in samples)))
+        return answers
+
+    def get_answers_and_cache(self, dataset, on_answer=None) -> dict:
+        if self.max_batch_tokens is not None:
+            return self.get_answers_bucketed_and_cache(dataset, on_answer)
+
+        answers = dict()
+        answered = dict()
+        prompt_count = 0
+        for entry in tqdm(dataset.items(), total=dataset.length):
+            with self.instrumentation.stage("prompt_generation"):
+                cases = self.get_all_cases(entry)
+            answer_entry = dict()
+            answer_entry["_id"] = entry["_id"]
+            answer_entry["context"] = entry["context"]
+            for case_id, prompt in cases.items():
+                answer = self.get_answer_deduplicated(entry["_id"], case_id, prompt, answered, self.get_max_new_tokens(entry, case_id))
+                prompt_count += 1
+                answer_entry[f"{case_id}_prompt"] = prompt
+                answer_entry[f"{case_id}_answer"] = answer
+            for case_id in self.empty_cases:
+                answer_entry[f"{case_id}_prompt"] = ""
+                answer_entry[f"{case_id}_answer"] = ""
+
+            answers[entry["_id"]] = answer_entry
+            with open(f"models/cached_answers/{self.output_file_name}", "w") as f:
+                json.dump(answers, f, indent=4)
+            if on_answer is not None:
+                on_answer(answer_entry)
+        if self.dedup_prompts:
+            self.report_dedup(prompt_count, len(answered))
+        self.save_token_cache()
+
+        return answers
+
+    def get_answers_bucketed_and_cache(self, dataset, on_answer=None) -> dict:
+        """Pre-tokenize the prompts of all entries, generate them in batches of similar length
+        and return the answers in dataset order."""
+        entries = list(dataset.items())
+        all_cases = dict()
+        with self.instrumentation.stage("prompt_generation"):
+            for entry in entries:
+                all_cases[entry["_id"]] = self.get_all_cases(entry)
+        groups = self.group_prompts(all_cases)
+        with self.instrumentation.stage("tokenization"):
+            token_ids = {(_id, case_id): self.get_token_ids(all_cases[_id][case_id]) for (_id, case_id) in groups.keys()}
+        lengths = {key: len(ids) for key, ids in token_ids.items()}
+        entries_by_id = {entry["_id"]: entry for entry in entries}
+        budgets = {key: self.get_group_max_new_tokens(groups[key], entries_by_id) for key in token_ids.keys()}
+        # Prompts with the same generation budget are batched together, so short budgets allow larger batches.
+        # Every prompt is expanded to num_samples sequences inside generate.
+        batches = []
+        for budget in sorted(set(budgets.values()), reverse=True):
+            budget_lengths = {key: length for key, length in lengths.items() if budgets[key] == budget}
+            batches += bucket_by_length(budget_lengths, self.max_batch_tokens // self.num_samples, reserve_tokens=budget)
+        print(f"Scheduled {len(token_ids)} prompts in {len(batches)} batches, padding ratio {padding_ratio(lengths, batches):.1%}")
+
+        generated = dict()
+        answers = dict()
+        for batch in tqdm(batches):
+            start = time.perf_counter()
+            with self.instrumentation.stage("generation"):
+                batch_answers = self.get_answers_batch([token_ids[key] for key in batch], budgets[batch[0]])
+            latency = time.perf_counter() - start
+            for key, (answer, output_tokens) in zip(batch, batch_answers):
+                for member in groups[key]:
+                    generated[member] = answer
+                self.instrumentation.record_call(key[0], key[1], latency, lengths[key], output_tokens)
+
+            completed = set(answers.keys())
+            answers = self.collect_answers(entries, all_cases, generated)
+            with open(f"models/cached_answers/{self.output_file_name}", "w") as f:
+                json.dump(answers, f, indent=4)
+            if on_answer is not None:
+                for _id, answer_entry in answers.items():
+                    if _id not in completed:
+                        on_answer(answer_entry)
+        self.save_token_cache()
+
+        return answers
@@ -0,0 +1,83 @@
+"""
+Implement wrapper for Llama-70b with assisted generation: Llama-8b proposes draft tokens, which Llama-70b verifies.
+Both models share the Llama 3 tokenizer. With greedy decoding, the answers are the same as without the draft model.
+"""
+
+from models.llama_70b import Llama70b
+from models.llama_8b import Llama8b
+from models.huggingface_model import load_causal_lm, MAX_NEW_TOKENS
+import time
+import torch
+
+class Llama70bAssisted(Llama70b):
+    draft_model_path = Llama8b.model_path
+
+    def __init__(self, model_name="llama-70b-assisted", output_file_name="output", prompt_generator=None, draft_model_path=None, verify_every=None, **kwargs):
+        if kwargs.get("max_batch_tokens") is not None:
+            raise ValueError("Assisted generation only supports one prompt at a time, --batch-tokens cannot be used.")
+        if kwargs.get("num_samples", 1) > 1:
+            raise ValueError("Assisted generation only supports one sample per prompt, --num-samples cannot be used.")
+        super().__init__(model_name, output_file_name, prompt_generator, **kwargs)
+        if draft_model_path is not None:
+            self.draft_model_path = draft_model_path
+        if kwargs.get("dry_run"):
+            # Nothing is generated in a dry run, so neither the draft model nor the counting hooks are needed.
+            return
+        # The draft model gets its inputs from the device of the target model's embeddings.
+        self.draft_model = load_causal_lm(self.draft_model_path, self.device, str(self.model.device), kwargs.get("quantize"))
+        self.verify_every = verify_every
+        self.assisted_calls = 0
+        # Every forward pass of the target model verifies one batch of draft tokens, every forward pass of the draft model proposes one.
+        self.forward_passes = {"target": 0, "draft": 0}
+        self.model.register_forward_hook(lambda module, inputs, outputs: self.count_forward_pass("target"))
+        self.draft_model.register_forward_hook(lambda module, inputs, outputs: self.count_forward_pass("draft"))
+
+    def count_forward_pass(self, model_role):
+        self.forward_passes[model_role] += 1
+
+    def generate(self, input_ids, assisted=True, max_new_tokens=MAX_NEW_TOKENS):
+        kwargs = {"assistant_model": self.draft_model} if assisted else dict()
+        return self.model.generate(input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=max_new_tokens, do_sample=self.do_sample, eos_token_id=self.get_terminators(), **kwargs)
+
+    def get_answer(self, prompt, max_new_tokens=MAX_NEW_TOKENS):
+        input_ids = self.get_input_ids(prompt)
+        target_before, draft_before = self.forward_passes["target"], self.forward_passes["draft"]
+        start = time.perf_counter()
+        outputs = self.generate(input_ids, max_new_tokens=max_new_tokens)
+        latency = time.perf_counter() - start
+        response = outputs[0][input_ids.shape[-1]:]
+        self.instrumentation.count_tokens(input_ids.shape[-1], response.shape[-1])
+        self.count_truncations([response.tolist()], self.get_terminators(), max_new_tokens)
+
+        target_passes = self.forward_passes["target"] - target_before
+        # The target model adds one token of its own per forward pass, all other tokens are accepted draft tokens.
+        self.instrumentation.count("assisted_target_passes", target_passes)
+        self.instrumentation.count("assisted_draft_tokens", self.forward_passes["draft"] - draft_before)
+        self.instrumentation.count("assisted_accepted_tokens", max(response.shape[-1] - target_passes, 0))
+
+        self.assisted_calls += 1
+        if self.verify_every is not None and self.assisted_calls % self.verify_every == 0:
+            # Generate without the draft model as well, to measure the speedup and check that greedy outputs are unchanged.
+            start = time.perf_counter()
+            reference = self.generate(input_ids, assisted=False, max_new_tokens=max_new_tokens)
+            self.instrumentation.count("assisted_verified_calls")
+            self.instrumentation.count("assisted_verified_seconds", latency)
+            self.instrumentation.count("reference_verified_seconds", time.perf_counter() - start)
+            if not torch.equal(reference[0], outputs[0]):
+                self.instrumentation.count("assisted_mismatches")
+        return self.decode_response(response)
+
+    def get_answers_and_cache(self, dataset, on_answer=None) -> dict:
+        answers = super().get_answers_and_cache(dataset, on_answer)
+        self.report_assisted()
+        return answers
+
+    def report_assisted(self):
+        counters = self.instrumentation.counters
+        draft_tokens = counters.get("assisted_draft_tokens", 0)
+        acceptance_rate = counters.get("assisted_accepted_tokens", 0) / draft_tokens if draft_tokens else 0.0
+        print(f"Assisted generation: {acceptance_rate:.1%} of {draft_tokens} draft tokens accepted.")
+        if counters.get("assisted_verified_calls", 0) > 0:
+            speedup = counters["reference_verified_seconds"] / counters["assisted_verified_seconds"]
+            mismatches = counters.get("assisted_mismatches", 0)
+            print(f"Measured on {counters['assisted_verified_calls']} prompts: {speedup:.2f}x speedup, {mismatches} outputs differ from generation without the draft model" + (" (expected with sampling)." if self.do_sample else "."))
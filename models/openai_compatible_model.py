@@ -0,0 +1,75 @@
+"""
+Use a model served behind an OpenAI-compatible endpoint, e.g. a local vLLM or TGI server.
+Many requests are kept in flight over a pool of HTTP connections, so the continuous batching of the server stays saturated.
+"""
+
+from models.openai_direct_model import OpenAIDirectModel
+from instrumentation import Instrumentation
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from openai import OpenAI
+from tqdm import tqdm
+import httpx
+import json
+import os
+
+DEFAULT_BASE_URL = "http://localhost:8000/v1"
+
+
+class OpenAICompatibleModel(OpenAIDirectModel):
+    def __init__(self, model_name="openai-compatible", output_file_name="output", prompt_generator=None, instrumentation=None, base_url=None, served_model=None, concurrency=32, dedup_prompts=False, num_samples=1, dry_run=False):
+        base_url = base_url or os.environ.get("OPENAI_COMPATIBLE_BASE_URL", DEFAULT_BASE_URL)
+        http_client = httpx.Client(limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency), timeout=httpx.Timeout(600.0, connect=10.0))
+        if dry_run:
+            # Do not contact the server; prompt lengths are then counted with a generic tokenizer.
+            self.model = None
+            self.model_name = served_model if served_model is not None else model_name
+        else:
+            # Local servers usually do not check the key, but the client requires one.
+            self.model = OpenAI(base_url=base_url, api_key=os.environ.get("OPENAI_API_KEY", "EMPTY"), http_client=http_client)
+            # Without an explicit model id, use the first (usually only) model of the server.
+            self.model_name = served_model if served_model is not None else self.model.models.list().data[0].id
+        self.output_file_name =  output_file_name
+        self.prompt_generator = prompt_generator
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.concurrency = concurrency
+        self.dedup_prompts = dedup_prompts
+        self.num_samples = num_samples
+
+    def get_answers_and_cache(self, dataset, on_answer=None):
+        entries = list(dataset.items())
+        all_cases = dict()
+        with self.instrumentation.stage("prompt_generation"):
+            for entry in entries:
+                all_cases[entry["_id"]] = self.get_all_cases(entry)
+        remaining = {_id: len(cases) for _id, cases in all_cases.items()}
+        groups = self.group_prompts(all_cases)
+
+        entries_by_id = {entry["_id"]: entry for entry in entries}
+
+        def answer(_id, case_id, prompt):
+            with self.instrumentation.call(_id, case_id):
+                return self.get_answer(prompt, self.get_group_max_new_tokens(groups[(_id, case_id)], entries_by_id))
+
+        generated = dict()
+        answers = dict()
+        with self.instrumentation.stage("concurrent_generation"), ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(answer, _id, case_id, all_cases[_id][case_id]): (_id, case_id) for (_id, case_id) in groups.keys()}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                result = future.result()
+                completed_ids = []
+                for _id, case_id in groups[futures[future]]:
+                    generated[(_id, case_id)] = result
+                    remaining[_id] -= 1
+                    if remaining[_id] == 0:
+                        completed_ids.append(_id)
+                if completed_ids:
+                    answers = self.collect_answers(entries, all_cases, generated)
+                    with open(f"models/cached_answers/{self.output_file_name}", "w") as f:
+                        json.dump(answers, f, indent=4)
+                    if on_answer is not None:
+                        for _id in completed_ids:
+                            on_answer(answers[_id])
+        if self.prompt_generator.shares_prefixes:
+            self.report_prefix_sharing()
+
+        return answers
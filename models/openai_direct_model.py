@@ -4,11 +4,17 @@ This method is faster, but also more expensive.
 """
 
 from models.abstract_model import AbstractModel
+from instrumentation import Instrumentation
 from openai import OpenAI
 import json
 from datetime import datetime
 from tqdm import tqdm
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
 SYSTEM_PROMPT = """
 You are a question answering system. The user will ask you a question and you will provide an answer.
 You can generate as much text as you want to get to the solution. Your final answer must be contained in two brackets: <answer> </answer>.
@@ -37,56 +43,94 @@ Please provide the answer in the following format: <answer>*your answer here*</a
 Answer as short as possible.
 """
 
+MAX_TOKENS = 256
+
+# Per chat message, and once for the start of the reply, see the OpenAI cookbook on counting tokens.
+TOKENS_PER_MESSAGE = 3
+# Rough average for English text, used when tiktoken is not installed.
+CHARACTERS_PER_TOKEN = 4
+
 class OpenAIDirectModel(AbstractModel):
-    def __init__(self, model_name="gpt-3.5-turbo", output_file_name="output", prompt_generator=None):
-        self.model = OpenAI()
+    max_new_tokens = MAX_TOKENS
+
+    def __init__(self, model_name="gpt-3.5-turbo", output_file_name="output", prompt_generator=None, instrumentation=None, dedup_prompts=False, num_samples=1, dry_run=False):
+        self.model = OpenAI() if not dry_run else None
         self.model_name = model_name.replace("-direct", "")
         self.output_file_name =  output_file_name
         self.prompt_generator = prompt_generator
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.dedup_prompts = dedup_prompts
+        self.num_samples = num_samples
 
-    def generate_text(self, prompt, max_tokens=256):
-        return self.model.chat.completions.create(
+    def generate_text(self, prompt, max_tokens=MAX_TOKENS):
+        response = self.model.chat.completions.create(
             model=self.model_name,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=max_tokens
-        ).choices[0].message.content
+            max_tokens=max_tokens,
+            n=self.num_samples
+        )
+        if response.usage is not None:
+            self.instrumentation.count_tokens(response.usage.prompt_tokens, response.usage.completion_tokens)
+            # Reported by OpenAI and by servers with prefix caching, e.g. vLLM with --enable-prompt-tokens-details.
+            details = getattr(response.usage, "prompt_tokens_details", None)
+            if details is not None and details.cached_tokens is not None:
+                self.instrumentation.count("cached_input_tokens", details.cached_tokens)
+        for choice in response.choices:
+            if choice.finish_reason == "length":
+                self.record_truncation(max_tokens)
+        if self.num_samples > 1:
+            return [choice.message.content for choice in response.choices]
+        return response.choices[0].message.content
     
-    def get_prompt(self, question_entry, context, question):
-        return self.prompt_generator.get_prompt(question_entry, context, question)
-
-    def get_answer(self, prompt):
-        return self.generate_text(prompt)
+    def count_text_tokens(self, text):
+        if tiktoken is None:
+            return max(1, round(len(text) / CHARACTERS_PER_TOKEN))
+        try:
+            encoding = tiktoken.encoding_for_model(self.model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return len(encoding.encode(text))
+
+    def count_prompt_tokens(self, prompt):
+        return self.count_text_tokens(SYSTEM_PROMPT) + self.count_text_tokens(prompt) + 3 * TOKENS_PER_MESSAGE
+
+    def get_answer(self, prompt, max_new_tokens=MAX_TOKENS):
+        return self.generate_text(prompt, max_new_tokens)
     
-    def get_all_cases(self, entry):
-        cases = dict()
-        context = entry["context"]
-        cases["case_1"] = self.get_prompt(entry, context, entry['question'])
-        cases["case_2"] = self.get_prompt(entry, context, entry['previous_question'])
-        cases["case_3"] = self.get_prompt(entry, context, entry['ques_on_last_hop'])
-        cases["case_6"] = self.get_prompt(entry, context, entry['question_decomposition'][0]["question"])
-        cases["case_5"] = self.get_prompt(entry, context, entry['question_decomposition'][1]["question"])
-        cases["case_4"] = self.get_prompt(entry, None, entry['question_decomposition'][2]["question"])
-
-        return cases
-
-    def get_answers_and_cache(self, dataset):
+    def get_answers_and_cache(self, dataset, on_answer=None):
+        entries = list(dataset.items())
+        all_cases = dict()
+        with self.instrumentation.stage("prompt_generation"):
+            for entry in entries:
+                all_cases[entry["_id"]] = self.get_all_cases(entry)
+        remaining = {_id: len(cases) for _id, cases in all_cases.items()}
+        # Grouped by identical prompts with --dedup-prompts, and ordered by prompt with shared few-shot examples.
+        groups = self.group_prompts(all_cases)
+        entries_by_id = {entry["_id"]: entry for entry in entries}
+
+        generated = dict()
         answers = dict()
-        for entry in tqdm(dataset.items(), total=dataset.length):
-            cases = self.get_all_cases(entry)
-            answer_entry = dict()
-            answer_entry["_id"] = entry["_id"]
-            answer_entry["context"] = entry["context"]
-            for case_id, prompt in cases.items():
-                answer = self.get_answer(prompt)
-                answer_entry[f"{case_id}_prompt"] = prompt
-                answer_entry[f"{case_id}_answer"] = answer
-                
-            answers[entry["_id"]] = answer_entry
-            with open(f"models/cached_answers/{self.output_file_name}", "w") as f:
-                json.dump(answers, f, indent=4)
+        for _id, case_id in tqdm(groups.keys()):
+            with self.instrumentation.call(_id, case_id):
+                answer = self.get_answer(all_cases[_id][case_id], self.get_group_max_new_tokens(groups[(_id, case_id)], entries_by_id))
+            completed_ids = []
+            for member_id, member_case_id in groups[(_id, case_id)]:
+                generated[(member_id, member_case_id)] = answer
+                remaining[member_id] -= 1
+                if remaining[member_id] == 0:
+                    completed_ids.append(member_id)
+            if completed_ids:
+                answers = self.collect_answers(entries, all_cases, generated)
+                with open(f"models/cached_answers/{self.output_file_name}", "w") as f:
+                    json.dump(answers, f, indent=4)
+                if on_answer is not None:
+                    for completed_id in completed_ids:
+                        on_answer(answers[completed_id])
+        if self.prompt_generator.shares_prefixes:
+            self.report_prefix_sharing()
 
         return answers
     
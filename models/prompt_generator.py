@@ -1,3 +1,5 @@
+from models.fewshot_index import FewShotIndex, family_and_variant
+import itertools
 import random
 random.seed(42)
 
@@ -27,21 +29,39 @@ Answer as short as possible.\n
 """
 
 class PromptGenerator:
+    registered_strategies = ["zeroshot", "zeroshot-cot", "2-shot", "2-shot-cot", "3-shot", "3-shot-cot"]
+    fewshot_selections = ["random", "similarity", "shared"]
+    # Whether prompts of different entries are built to start with the same text, see FewShotGenerator.
+    shares_prefixes = False
     
+    def get_case_prompts(self, entry):
+        """Prompts of all cases of an entry: the question, the previous question, the question on the last hop
+        and the three subquestions, the last one without context."""
+        cases = dict()
+        context = entry["context"]
+        cases["case_1"] = self.get_prompt(entry, context, entry['question'])
+        cases["case_2"] = self.get_prompt(entry, context, entry['previous_question'])
+        cases["case_3"] = self.get_prompt(entry, context, entry['ques_on_last_hop'])
+        cases["case_6"] = self.get_prompt(entry, context, entry['question_decomposition'][0]["question"])
+        cases["case_5"] = self.get_prompt(entry, context, entry['question_decomposition'][1]["question"])
+        cases["case_4"] = self.get_prompt(entry, None, entry['question_decomposition'][2]["question"])
+
+        return cases
+
     @staticmethod
-    def create(prompt_type, dataset=None):
+    def create(prompt_type, dataset=None, selection="random"):
         if prompt_type == "zeroshot":
             return ZeroShotGenerator()
         elif prompt_type == "2-shot":
-            return FewShotGenerator(dataset, 2)
+            return FewShotGenerator(dataset, 2, selection=selection)
         elif prompt_type == "3-shot":
-            return FewShotGenerator(dataset, 3)
+            return FewShotGenerator(dataset, 3, selection=selection)
         elif prompt_type == "zeroshot-cot":
             return ZeroShotGenerator(cot=True)
         elif prompt_type == "2-shot-cot":
-            return FewShotGenerator(dataset, shots=2, cot=True)
+            return FewShotGenerator(dataset, shots=2, cot=True, selection=selection)
         elif prompt_type == "3-shot-cot":
-            return FewShotGenerator(dataset, shots=3, cot=True)
+            return FewShotGenerator(dataset, shots=3, cot=True, selection=selection)
         
 
 class ZeroShotGenerator(PromptGenerator):
@@ -65,14 +85,52 @@ class ZeroShotGenerator(PromptGenerator):
     
 
 class FewShotGenerator(PromptGenerator):
-    def __init__(self, dataset, shots=2, cot=False):
+    def __init__(self, dataset, shots=2, cot=False, selection="random"):
         self.shots = shots
         self.dataset = dataset
         self.cot = cot
+        if selection not in self.fewshot_selections:
+            raise ValueError(f"Few-shot selection {selection} not supported. Possible options: " + ", ".join(self.fewshot_selections))
+        # With similarity selection, the examples whose questions are closest to the question (TF-IDF) are used instead of random ones.
+        self.index = FewShotIndex(dataset) if selection == "similarity" else None
+        # With shared selection, all questions of a group get the same examples, so their prompts share the prefix up to the question.
+        self.shares_prefixes = selection == "shared"
+        self.shared_orders = dict()
+
+    def get_case_type(self, question_entry, question):
+        """Which question of the entry is asked, matched in the same order as in get_fewshot_examples."""
+        decomposition = question_entry['question_decomposition']
+        for case_type, entry_question in [("question", question_entry['question']), ("previous_question", question_entry['previous_question']), ("ques_on_last_hop", question_entry['ques_on_last_hop']),
+                                          ("subquestion_1", decomposition[0]["question"]), ("subquestion_2", decomposition[1]["question"]), ("subquestion_3", decomposition[2]["question"])]:
+            if entry_question == question:
+                return case_type
+        raise ValueError(f"Something changed with this question: {question}")
+
+    def select_shared_entries(self, question_entry, question):
+        """Examples from a fixed order per (answer_type, previous_answer_type, case type) group: the first ones that are
+        allowed for this entry. Most entries of a group get the same examples; entries from the family or with the
+        variant of one of them get the next allowed ones instead."""
+        group = (question_entry['answer_type'], question_entry['previous_answer_type'], self.get_case_type(question_entry, question))
+        if group not in self.shared_orders:
+            candidates = [(entry, entry_family, entry_variant) for entry, entry_family, entry_variant in zip(self.dataset.items(), self.dataset.families, self.dataset.variants) if (entry['answer_type'] == question_entry['answer_type']) and (entry['previous_answer_type'] == question_entry['previous_answer_type'])]
+            # Seeded by the group, so the order does not depend on which groups were seen before.
+            self.shared_orders[group] = random.Random(" ".join(group)).sample(candidates, len(candidates))
+        family, variant = family_and_variant(question_entry['_id'])
+        allowed = (entry for entry, entry_family, entry_variant in self.shared_orders[group] if (entry_family != family) and (entry_variant != variant))
+        return list(itertools.islice(allowed, self.shots))
+
+    def select_fewshot_entries(self, question_entry, question):
+        if self.index is not None:
+            return self.index.nearest(question_entry, question, self.shots)
+        if self.shares_prefixes:
+            return self.select_shared_entries(question_entry, question)
+        family, variant = family_and_variant(question_entry['_id'])
+        # The dataset loader splits the ids of its entries once, see DatasetLoader.load_json.
+        possible_entries = [entry for entry, entry_family, entry_variant in zip(self.dataset.items(), self.dataset.families, self.dataset.variants) if (entry['answer_type'] == question_entry['answer_type']) and (entry['previous_answer_type'] == question_entry['previous_answer_type']) and (entry_family != family) and (entry_variant != variant)]
+        return random.sample(possible_entries, self.shots) if len(possible_entries) >= self.shots else possible_entries
 
     def get_fewshot_examples(self, question_entry, question):
-        possible_entries = [entry for entry in self.dataset.items() if (entry['answer_type'] == question_entry['answer_type']) and (entry['previous_answer_type'] == question_entry['previous_answer_type']) and (entry['_id'].split("_")[:-1] != question_entry['_id'].split("_")[:-1]) and (entry['_id'].split("_")[-1] != question_entry['_id'].split("_")[-1])]
-        fewshot_entries = random.sample(possible_entries, self.shots) if len(possible_entries) >= self.shots else possible_entries
+        fewshot_entries = self.select_fewshot_entries(question_entry, question)
 
         res = ""
         for j in range(len(fewshot_entries)):
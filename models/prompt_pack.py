@@ -0,0 +1,95 @@
+"""
+Prompt packs: the prompts of one dataset and strategy, rendered once by the prompt generator and saved to disk.
+The rendered prompts do not depend on the model, only the chat template does, which every model applies itself
+(see AbstractModel.format_prompt). All models that read the same pack therefore get byte-identical prompts.
+"""
+import gzip
+import json
+import os
+import random
+from models.abstract_model import prompt_hash
+from models.prompt_generator import PromptGenerator
+
+PROMPT_PACK_DIR = "models/prompt_packs"
+# Seed of the global random state before the prompts of a run are rendered, see run_cell.
+DEFAULT_SEED = 42
+
+
+def pack_path(dataset_name, strategy, fewshot_selection="random", seed=DEFAULT_SEED, directory=PROMPT_PACK_DIR):
+    return os.path.join(directory, f"{dataset_name}_{strategy}_{fewshot_selection}_seed{seed}.json.gz")
+
+
+def pack_info(dataset_name, dataset, strategy, fewshot_dataset_name, fewshot_dataset, fewshot_selection, seed):
+    """Everything the prompts of a pack depend on. The datasets are included by a hash of their entries, so a pack
+    is rebuilt when a dataset changes."""
+    return {
+        "dataset": dataset_name,
+        "dataset_hash": prompt_hash(list(dataset.items())),
+        "strategy": strategy,
+        "fewshot_dataset": fewshot_dataset_name,
+        "fewshot_dataset_hash": prompt_hash(list(fewshot_dataset.items())),
+        "fewshot_selection": fewshot_selection,
+        "seed": seed,
+    }
+
+
+def get_prompt_pack(dataset_name, dataset, strategy, fewshot_dataset_name, fewshot_dataset, fewshot_selection="random", seed=DEFAULT_SEED, directory=PROMPT_PACK_DIR, rebuild=False):
+    """Load the prompt pack of a dataset and strategy, or build and save it if it is missing or outdated."""
+    path = pack_path(dataset_name, strategy, fewshot_selection, seed, directory)
+    if os.path.exists(path) and not rebuild:
+        pack = PromptPack.load(path)
+        if pack.info == pack_info(dataset_name, dataset, strategy, fewshot_dataset_name, fewshot_dataset, fewshot_selection, seed):
+            return pack
+        print(f"Prompt pack {path} was built from other datasets, rebuilding it.")
+    pack = PromptPack.build(dataset_name, dataset, strategy, fewshot_dataset_name, fewshot_dataset, fewshot_selection, seed)
+    pack.save(path)
+    return pack
+
+
+class PromptPack:
+    def __init__(self, info, records):
+        # info: see pack_info.
+        # records: list of [_id, case_id, prompt, hash of the prompt] in dataset and case order.
+        self.info = info
+        self.records = records
+        self.cases = dict()
+        for _id, case_id, prompt, _ in records:
+            self.cases.setdefault(_id, dict())[case_id] = prompt
+
+    @staticmethod
+    def build(dataset_name, dataset, strategy, fewshot_dataset_name, fewshot_dataset, fewshot_selection="random", seed=DEFAULT_SEED):
+        """Render the prompts of all cases of all entries, with the random state a run of the strategy starts with."""
+        random.seed(seed)
+        prompt_generator = PromptGenerator.create(strategy, fewshot_dataset, fewshot_selection)
+        records = []
+        for entry in dataset.items():
+            for case_id, prompt in prompt_generator.get_case_prompts(entry).items():
+                records.append([entry["_id"], case_id, prompt, prompt_hash(prompt)])
+        return PromptPack(pack_info(dataset_name, dataset, strategy, fewshot_dataset_name, fewshot_dataset, fewshot_selection, seed), records)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump({"info": self.info, "records": self.records}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def load(path):
+        """Load a pack and check the hash of every prompt."""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            pack = json.load(f)
+        for _id, case_id, prompt, digest in pack["records"]:
+            if prompt_hash(prompt) != digest:
+                raise ValueError(f"Prompt pack {path} is corrupted: prompt of {_id} {case_id} does not match its hash.")
+        return PromptPack(pack["info"], pack["records"])
+
+    def get_cases(self, _id):
+        """Prompts of all cases of an entry, in the order in which they were rendered."""
+        if _id not in self.cases:
+            raise ValueError(f"Entry {_id} is not in the prompt pack of {self.info['dataset']} {self.info['strategy']}, rebuild it with build_prompts.py.")
+        return self.cases[_id]
+
+    def content_hash(self):
+        """Hash of all prompts of the pack, identical for every model that reads it."""
+        return prompt_hash([digest for _, _, _, digest in self.records])
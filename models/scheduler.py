@@ -0,0 +1,36 @@
+"""
+Group prompts into length buckets for batched generation.
+Batches are formed from prompts of similar token length, so little compute is spent on padding.
+"""
+
+
+def bucket_by_length(lengths: dict, max_batch_tokens, reserve_tokens=0, max_batch_size=None):
+    """Split the keys of `lengths` into batches of similar length.
+
+    The cost of a batch is its padded size, i.e. number of sequences times the longest
+    prompt in the batch plus `reserve_tokens` (the tokens to be generated per sequence).
+    Every batch stays within `max_batch_tokens`, except single prompts that exceed it on their own.
+    Batches are returned longest first, so memory problems show up at the start of a run.
+
+    Returns: list of batches, each a list of keys of `lengths`."""
+    batches = []
+    batch = []
+    for key in sorted(lengths.keys(), key=lambda k: lengths[k], reverse=True):
+        # Keys are sorted by decreasing length, so the first key of a batch is its longest prompt.
+        longest = lengths[batch[0]] if batch else lengths[key]
+        too_many_tokens = (len(batch) + 1) * (longest + reserve_tokens) > max_batch_tokens
+        too_many_sequences = max_batch_size is not None and len(batch) >= max_batch_size
+        if batch and (too_many_tokens or too_many_sequences):
+            batches.append(batch)
+            batch = []
+        batch.append(key)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def padding_ratio(lengths: dict, batches):
+    """Fraction of prompt tokens in the given batches that are padding."""
+    real_tokens = sum(lengths.values())
+    padded_tokens = sum(len(batch) * max(lengths[key] for key in batch) for batch in batches)
+    return 1 - real_tokens / padded_tokens if padded_tokens else 0.0
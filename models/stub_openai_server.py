@@ -0,0 +1,68 @@
+"""
+Minimal stand-in for an OpenAI-compatible inference server, to check the openai-compatible backend without a GPU.
+Answers every chat completion with a fixed answer after an optional delay.
+
+Format: python3 -m models.stub_openai_server --port 8000 --delay 0.05
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_MODEL = "stub-model"
+STUB_ANSWER = "<answer>stub</answer>"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json({"object": "list", "data": [{"id": STUB_MODEL, "object": "model", "created": 0, "owned_by": "stub"}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.delay)
+        # Whitespace tokens are close enough to report plausible usage numbers.
+        prompt_tokens = sum(len(message["content"].split()) for message in request["messages"])
+        choices = [{"index": i, "message": {"role": "assistant", "content": STUB_ANSWER}, "finish_reason": "stop"} for i in range(request.get("n", 1))]
+        self.send_json({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", STUB_MODEL),
+            "choices": choices,
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 3 * len(choices), "total_tokens": prompt_tokens + 3 * len(choices)},
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stand-in OpenAI-compatible server.")
+    parser.add_argument('--port', type=int, help='Port to listen on. Default: 8000', default=8000)
+    parser.add_argument('--delay', type=float, help='Seconds to wait before answering each request. Default: 0', default=0.0)
+    args = parser.parse_args()
+
+    StubHandler.delay = args.delay
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    print(f"Stub server listening on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Persistent cache of tokenized prompts.
+Token ids of all prompts seen with a tokenizer are appended to one int32 file, which is memory-mapped on read.
+A JSON index maps the hash of each rendered prompt to its offset and length in that file,
+so reruns skip tokenization.
+Several processes with the same tokenizer (e.g. llama-8b and baseline in one sweep) share the cache; appends and
+index updates are serialized with a file lock.
+"""
+from models.abstract_model import prompt_hash
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+import numpy as np
+
+TOKEN_CACHE_DIR = "models/token_cache"
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Short hash identifying a tokenizer, including its vocabulary size and chat template."""
+    description = json.dumps([tokenizer.name_or_path, len(tokenizer), getattr(tokenizer, "chat_template", None)], default=str)
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()[:16]
+
+
+class TokenCache:
+    def __init__(self, tokenizer, directory=TOKEN_CACHE_DIR):
+        self.directory = os.path.join(directory, tokenizer_fingerprint(tokenizer))
+        os.makedirs(self.directory, exist_ok=True)
+        self.tokens_path = os.path.join(self.directory, "tokens.bin")
+        self.index_path = os.path.join(self.directory, "index.json")
+        self.lock_path = os.path.join(self.directory, "lock")
+        with self.locked():
+            self.size = os.path.getsize(self.tokens_path) // 4 if os.path.exists(self.tokens_path) else 0
+            self.index = self.read_index()
+        self.hits = 0
+        self.misses = 0
+        self._tokens = None
+        self._changed = False
+
+    @contextmanager
+    def locked(self):
+        """Hold the lock of the cache directory, shared by all processes using the cache."""
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read_index(self):
+        """Index on disk. Only keeps entries that lie completely inside the token file, in case a run stopped while writing."""
+        if not os.path.exists(self.index_path):
+            return dict()
+        with open(self.index_path, "r") as f:
+            index = json.load(f)
+        size = os.path.getsize(self.tokens_path) // 4 if os.path.exists(self.tokens_path) else 0
+        return {key: value for key, value in index.items() if value[0] + value[1] <= size}
+
+    def tokens(self):
+        """Memory-mapped view of all cached token ids, remapped after new tokens were appended."""
+        if self._tokens is None or len(self._tokens) < self.size:
+            self._tokens = np.memmap(self.tokens_path, dtype=np.int32, mode="r") if self.size > 0 else np.zeros(0, dtype=np.int32)
+        return self._tokens
+
+    def get(self, prompt, tokenize):
+        """Return the token ids of a prompt as an int32 array, calling tokenize(prompt) only if it is not cached."""
+        key = prompt_hash(prompt)
+        if key in self.index:
+            self.hits += 1
+            offset, length = self.index[key]
+            return self.tokens()[offset:offset + length]
+
+        self.misses += 1
+        token_ids = np.asarray(tokenize(prompt), dtype=np.int32)
+        # Other processes may have appended since, so the offset is the current end of the file.
+        with self.locked(), open(self.tokens_path, "ab") as f:
+            end = f.seek(0, os.SEEK_END)
+            # Realign after a write that was cut off.
+            f.write(b"\0" * (-end % 4))
+            offset = (end + 3) // 4
+            f.write(token_ids.tobytes())
+        self.index[key] = [offset, len(token_ids)]
+        self.size = max(self.size, offset + len(token_ids))
+        self._changed = True
+        return token_ids
+
+    def save(self):
+        """Write the index, merged with the entries other processes have written meanwhile."""
+        if not self._changed:
+            return
+        with self.locked():
+            index = self.read_index()
+            index.update(self.index)
+            temp_path = self.index_path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(temp_path, self.index_path)
+            self.size = os.path.getsize(self.tokens_path) // 4
+        self.index = index
+        self._changed = False
@@ -0,0 +1,85 @@
+"""
+Score answers while generation continues.
+Answer entries are handed to a bounded queue as soon as the model finishes them, and worker threads
+postprocess and score them in the background. Running metrics are printed as they accumulate.
+"""
+import queue
+import threading
+from evaluate import evaluate_entry, evaluate_entry_baseline
+from postprocess import postprocess_entry, postprocess_entry_baseline
+from instrumentation import Instrumentation
+
+_DONE = object()
+
+
+class ScoringPipeline:
+    def __init__(self, dataset, baseline=False, workers=1, queue_size=64, report_every=50, instrumentation=None):
+        self.entries = {entry["_id"]: entry for entry in dataset.items()}
+        self.order = list(self.entries.keys())
+        self.case_ids = ["case_1", "case_2"] if baseline else ["case_1", "case_2", "case_3", "case_4", "case_5", "case_6"]
+        self.postprocess_entry = postprocess_entry_baseline if baseline else postprocess_entry
+        self.evaluate_entry = evaluate_entry_baseline if baseline else evaluate_entry
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        self.report_every = report_every
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.results = dict()
+        self.totals = {case_id: {"em": 0.0, "f1": 0.0} for case_id in self.case_ids}
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    def submit(self, answer_entry):
+        """Queue a finished answer entry. Blocks while the queue is full, so generation cannot run arbitrarily far ahead."""
+        self.queue.put(answer_entry)
+
+    def finish(self):
+        """Wait until all queued answers are scored.
+
+        Returns: dict of results in dataset order, like evaluate_all."""
+        for _ in self.workers:
+            self.queue.put(_DONE)
+        for worker in self.workers:
+            worker.join()
+        if self.errors:
+            raise self.errors[0]
+        self.report()
+        return {_id: self.results[_id] for _id in self.order if _id in self.results}
+
+    def _work(self):
+        while True:
+            answer_entry = self.queue.get()
+            if answer_entry is _DONE:
+                return
+            if self.errors:
+                # Keep draining the queue after an error, so that submit never blocks forever.
+                continue
+            try:
+                with self.instrumentation.stage("postprocessing"):
+                    postprocessed = self.postprocess_entry(answer_entry, self.entries[answer_entry["_id"]])
+                with self.instrumentation.stage("scoring"):
+                    result_entry = self.evaluate_entry(postprocessed)
+            except Exception as e:
+                self.errors.append(e)
+                continue
+            with self._lock:
+                self.results[result_entry["_id"]] = result_entry
+                for case_id in self.case_ids:
+                    self.totals[case_id]["em"] += float(result_entry[case_id + "_em"])
+                    self.totals[case_id]["f1"] += result_entry[case_id + "_f1"]
+                if len(self.results) % self.report_every == 0:
+                    self.report()
+
+    def running_metrics(self):
+        """Mean EM and F1 per case over all entries scored so far."""
+        scored = len(self.results)
+        return {case_id: {metric: total / scored if scored else 0.0 for metric, total in totals.items()} for case_id, totals in self.totals.items()}
+
+    def report(self):
+        metrics = self.running_metrics()
+        cases = ", ".join(f"{case_id} EM {metrics[case_id]['em']:.3f} F1 {metrics[case_id]['f1']:.3f}" for case_id in self.case_ids)
+        print(f"\n[scored {len(self.results)}/{len(self.order)}] {cases}")
@@ -158,14 +158,57 @@ def postprocess(model_answer, ground_truth_answer):
     return res_entry
 
 
+def majority_vote(predictions):
+    """Return the most frequent prediction. Ties go to the prediction that was sampled first."""
+    return Counter(predictions).most_common(1)[0][0]
+
+
+def postprocess_samples(postprocess_function, model_answer, ground_truth_answer):
+    """Postprocess a model answer whose case answers may be lists of samples.
+
+    Every sample is postprocessed on its own, and the extracted prediction of a case is the majority vote
+    over its samples. The postprocessed predictions of all samples are kept as <case>_pred_samples."""
+    sample_counts = [len(value) for key, value in model_answer.items() if key.endswith("_answer") and isinstance(value, list)]
+    if not sample_counts:
+        return postprocess_function(model_answer, ground_truth_answer)
+
+    samples = []
+    for i in range(max(sample_counts)):
+        # Only the answers are sampled; other list fields (the context, chat prompts) are copied unchanged.
+        sample_answer = {key: value[i] if key.endswith("_answer") and isinstance(value, list) else value for key, value in model_answer.items()}
+        samples.append(postprocess_function(sample_answer, ground_truth_answer))
+    res_entry = dict(samples[0])
+    for key in samples[0].keys():
+        if key.endswith("_pred_extr"):
+            predictions = [sample[key] for sample in samples]
+            res_entry[key.replace("_pred_extr", "_pred_samples")] = predictions
+            res_entry[key] = majority_vote(predictions)
+    return res_entry
+
+
+def postprocess_entry_baseline(model_answer, entry):
+    """Merge the baseline answer into a copy of its dataset entry and add the extracted predictions."""
+    result_entry = deepcopy(entry)
+    result_entry["_id"] = entry["_id"]
+    result_entry.update(model_answer)
+    result_entry.update(postprocess_samples(postprocess_baseline, model_answer, entry))
+    return result_entry
+
+
+def postprocess_entry(model_answer, entry):
+    """Merge a model answer into a copy of its dataset entry and add the extracted predictions."""
+    result_entry = deepcopy(entry)
+    result_entry["_id"] = entry["_id"]
+    result_entry.update(model_answer)
+    result_entry.update(postprocess_samples(postprocess, model_answer, entry))
+    return result_entry
+
+
 def postprocess_all_baseline(model_answers: dict, dataset: DatasetLoader):
     res = dict()
     data = dataset.items()
     for entry in tqdm(data, total=dataset.length):
-        result_entry = deepcopy(entry)
-        result_entry["_id"] = entry["_id"]
-        result_entry.update(model_answers[entry["_id"]])
-        result_entry.update(postprocess_baseline(model_answers[entry["_id"]], entry))
+        result_entry = postprocess_entry_baseline(model_answers[entry["_id"]], entry)
         res[result_entry["_id"]] = result_entry
     return res
 
@@ -175,9 +218,6 @@ def postprocess_all(model_answers: dict, dataset: DatasetLoader):
     res = dict()
     data = dataset.items()
     for entry in tqdm(data, total=dataset.length):
-        result_entry = deepcopy(entry)
-        result_entry["_id"] = entry["_id"]
-        result_entry.update(model_answers[entry["_id"]])
-        result_entry.update(postprocess(model_answers[entry["_id"]], entry))
+        result_entry = postprocess_entry(model_answers[entry["_id"]], entry)
         res[result_entry["_id"]] = result_entry
     return res
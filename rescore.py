@@ -0,0 +1,115 @@
+"""Re-score cached model answers
+
+Format: python3 rescore.py models/cached_answers/*.json --dataset morehopqa --output-dir results
+
+Postprocesses and scores cached answer files again, e.g. after changing postprocess.py or evaluate.py.
+The scores of every entry are stored together with a fingerprint of the postprocessing/scoring code and of
+the entry's inputs, and only entries whose fingerprint changed are recomputed on later calls.
+"""
+import argparse
+import hashlib
+import json
+import os
+from copy import deepcopy
+from tqdm import tqdm
+import evaluate
+import postprocess
+from evaluate import evaluate_entry, evaluate_entry_baseline
+from postprocess import postprocess_entry, postprocess_entry_baseline
+from datasets.abstract_dataset_loader import DatasetLoader
+
+RESCORE_CACHE_DIR = "results/rescore_cache"
+BASELINE_EMPTY_CASES = ["case_3", "case_4", "case_5", "case_6"]
+
+
+def code_version():
+    """Fingerprint of the postprocessing and scoring code, including the spaCy model used for NER."""
+    code_hash = hashlib.sha256()
+    for module in [postprocess, evaluate]:
+        with open(module.__file__, "rb") as f:
+            code_hash.update(f.read())
+    code_hash.update(f"{postprocess.nlp.meta['name']}-{postprocess.nlp.meta['version']}".encode("utf-8"))
+    return code_hash.hexdigest()
+
+
+def entry_fingerprint(version, answer_entry, entry):
+    return hashlib.sha256(json.dumps([version, answer_entry, entry], sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def is_baseline(answer_entry):
+    """Baseline answers are cached with empty prompts for cases 3 to 6."""
+    return all(answer_entry.get(f"{case_id}_prompt") == "" for case_id in BASELINE_EMPTY_CASES)
+
+
+def score_entry(answer_entry, entry):
+    if is_baseline(answer_entry):
+        return evaluate_entry_baseline(postprocess_entry_baseline(answer_entry, entry))
+    return evaluate_entry(postprocess_entry(answer_entry, entry))
+
+
+def rescore_file(path, dataset_entries, version, output_dir="results", store_dir=RESCORE_CACHE_DIR, force=False):
+    """Re-score one cached answer file and write its results file.
+
+    Returns: (results, number of recomputed entries)"""
+    with open(path, "r") as f:
+        answers = json.load(f)
+    file_name = os.path.basename(path)
+    store_path = os.path.join(store_dir, file_name)
+    store = dict()
+    if os.path.exists(store_path) and not force:
+        with open(store_path, "r") as f:
+            store = json.load(f)
+
+    results = dict()
+    new_store = dict()
+    recomputed = 0
+    for _id, answer_entry in tqdm(answers.items(), total=len(answers), desc=file_name):
+        if _id not in dataset_entries:
+            raise ValueError(f"Entry {_id} of {path} not found in the given datasets.")
+        entry = dataset_entries[_id]
+        fingerprint = entry_fingerprint(version, answer_entry, entry)
+        stored = store.get(_id)
+        if stored is not None and stored["fingerprint"] == fingerprint:
+            result_entry = deepcopy(entry)
+            result_entry.update(answer_entry)
+            result_entry.update(stored["scores"])
+        else:
+            result_entry = score_entry(answer_entry, entry)
+            stored = {"fingerprint": fingerprint, "scores": {key: value for key, value in result_entry.items() if key not in entry and key not in answer_entry}}
+            recomputed += 1
+        results[_id] = result_entry
+        new_store[_id] = stored
+
+    results_path = os.path.join(output_dir, file_name)
+    if recomputed > 0 or not os.path.exists(results_path):
+        with open(results_path, "w") as f:
+            json.dump(results, f, indent=4)
+    if recomputed > 0 or len(new_store) != len(store):
+        with open(store_path, "w") as f:
+            json.dump(new_store, f)
+    return results, recomputed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score cached model answers, recomputing only entries whose inputs or scoring code changed.")
+    parser.add_argument('cache_files', type=str, nargs='+', help='Cached answer files, e.g. models/cached_answers/*.json')
+    parser.add_argument('--dataset', type=str, nargs='+', help='Dataset(s) containing the ground truth of the cached entries. Possible options: ' + ', '.join(DatasetLoader.registered_datasets) + '. Default: morehopqa', default=["morehopqa"])
+    parser.add_argument('--output-dir', type=str, help='Directory to write the results files to, named like the cached answer files. Default: results', default="results")
+    parser.add_argument('--force', action='store_true', help='Recompute all entries.')
+    args = parser.parse_args()
+
+    dataset_entries = dict()
+    for dataset_name in args.dataset:
+        for entry in DatasetLoader.create(dataset_name).items():
+            dataset_entries[entry["_id"]] = entry
+    os.makedirs(RESCORE_CACHE_DIR, exist_ok=True)
+    version = code_version()
+    print(f"Scoring code version: {version[:12]}")
+
+    for path in args.cache_files:
+        results, recomputed = rescore_file(path, dataset_entries, version, args.output_dir, force=args.force)
+        correct = [result["case_1_em"] for result in results.values()].count(True)
+        print(f"{path}: {recomputed}/{len(results)} entries recomputed, correct answers in overall question: {correct}/{len(results)}")
+
+if __name__ == '__main__':
+    main()
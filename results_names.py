@@ -0,0 +1,29 @@
+"""
+Names of cache and results files, e.g. final_llama-8b_2-shot_morehopqa_240601-120000.json, as written by run_evaluation.py.
+"""
+import os
+import re
+from datasets.abstract_dataset_loader import DatasetLoader
+from models.abstract_model import AbstractModel
+from models.prompt_generator import PromptGenerator
+
+
+def _alternatives(names):
+    # Longest names first, so that e.g. 2-shot-cot is not matched as 2-shot.
+    return "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+
+
+RESULTS_NAME = re.compile(
+    f"^(?P<output_file>.*?)_(?P<model>{_alternatives(AbstractModel.registered_models)})"
+    f"_(?P<strategy>{_alternatives(PromptGenerator.registered_strategies)})"
+    f"(?:_(?P<dataset>{_alternatives(DatasetLoader.registered_datasets)}))?"
+    r"(?:_(?P<timestamp>\d{6}-\d{6}))?$"
+)
+
+
+def parse_results_name(path):
+    """Split a results file name like final_llama-8b_2-shot_morehopqa_240601-120000.json into its parts.
+
+    Returns: dict with output_file, model, strategy, dataset and timestamp (the last two may be None), or None."""
+    match = RESULTS_NAME.match(os.path.splitext(os.path.basename(path))[0])
+    return match.groupdict() if match is not None else None
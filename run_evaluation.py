@@ -1,59 +1,88 @@
 """Run evaluation on dataset
 
-Format: python3 run_evaluation.py --model ... --dataset ... --fewshot-dataset ... --output_file_name ...
+Format: python3 run_evaluation.py --model ... --dataset ... --fewshot-dataset ... --strategy ... --output_file ...
+
+Several datasets and strategies can be given at once, e.g. --dataset morehopqa morehopqa-150 --strategy zeroshot 2-shot,
+or read from a sweep config with --sweep-config. All combinations are then run with a single loaded model.
 """
 import argparse
 from evaluate import evaluate_all, evaluate_baseline
 from datasets.abstract_dataset_loader import DatasetLoader
 from models.abstract_model import AbstractModel
 from models.prompt_generator import PromptGenerator
+import random
 import sys
 from datetime import datetime
 from postprocess import postprocess_all, postprocess_all_baseline
+from instrumentation import Instrumentation
+from pipeline import ScoringPipeline
+from dry_run import plan_budget, format_budget
+from models.generation_budget import GenerationBudget
+from models.prompt_pack import get_prompt_pack, DEFAULT_SEED
 import json
 
-def main():
-    parser = argparse.ArgumentParser(description="Process model and dataset flags.")
-    parser.add_argument('--model', type=str, help='Model to use. Possible options: ' + ', '.join(AbstractModel.registered_models) + '.')
-    parser.add_argument('--dataset', type=str, help='Dataset to use. Possible options: ' + ', '.join(DatasetLoader.registered_datasets) + '.')
-    parser.add_argument('--fewshot-dataset', type=str, help='Dataset to use to collect few-shot examples. Possible options: ' + ', '.join(DatasetLoader.registered_datasets) + '.', default="morehopqa")
-    parser.add_argument('--strategy', type=str, help="Prompting strategy to use. Possible options: zeroshot, zeroshot-cot, 2-shot, 2-shot-cot, 3-shot, 3-shot-cot")
-    parser.add_argument('--output_file', type=str, help='First part of the name of the output file. Will also include model, strategy, dataset and timestamp. Default: output')
-
-    args = parser.parse_args()
+def load_sweep_config(path):
+    """Load a sweep config, a JSON file with the lists "strategies" and "datasets" and optionally "fewshot_dataset"."""
+    with open(path, "r") as f:
+        config = json.load(f)
+    for key in ["strategies", "datasets"]:
+        if not isinstance(config.get(key), list):
+            raise ValueError(f"Sweep config {path} must contain a list of {key}.")
+    return config
 
-    if args.model is None or args.dataset is None or args.strategy is None:
-        print("Missing arguments. Here are the possible options:")
-        print("For --model: " + ", ".join(AbstractModel.registered_models))
-        print("For --dataset: " + ", ".join(DatasetLoader.registered_datasets))
-        print("For --strategy: zeroshot, zeroshot-cot, 2-shot, 2-shot-cot, 3-shot, 3-shot-cot")
-        sys.exit(1)
 
-    dataset = DatasetLoader.create(args.dataset)
-    fewshot_dataset = DatasetLoader.create(args.fewshot_dataset)
-    prompt_generator = PromptGenerator.create(args.strategy, fewshot_dataset)
-    model = AbstractModel.create(args.model, args.output_file, prompt_generator) if args.output_file is not None else AbstractModel.create(model_name=args.model, output_file_name="output")
+def run_cell(model, args, dataset_name, dataset, strategy, fewshot_dataset, instrumentation, prometheus_file=None):
+    """Run the loaded model on one dataset with one strategy and write cache, results and metrics files."""
+    # Few-shot examples are sampled from the global random state; reset it so every cell
+    # gets the same examples as in a separate run.
+    random.seed(args.seed)
+    run_name = f"{args.output_file}_{args.model}_{strategy}_{dataset_name}_{datetime.now().strftime('%y%m%d-%H%M%S')}"
+    prompt_generator = PromptGenerator.create(strategy, fewshot_dataset, args.fewshot_selection)
+    prompt_pack = None
+    # The baseline asks shortened questions, which are not in the packs.
+    if args.prompt_packs and args.model != "baseline":
+        with instrumentation.stage("prompt_pack_load"):
+            prompt_pack = get_prompt_pack(dataset_name, dataset, strategy, args.fewshot_dataset, fewshot_dataset, args.fewshot_selection, args.seed)
+    generation_budget = None
+    if args.adaptive_budget:
+        dataset_entries = {entry["_id"]: entry for entry in dataset.items()}
+        generation_budget = GenerationBudget.from_cached_answers(model, args.model, strategy, dataset_entries, model.max_new_tokens, args.budget_percentile)
+        print(f"Generation budget per case/answer type (others: {generation_budget.default}): {generation_budget.to_dict()}")
+    model.prepare_run(f"{run_name}.json", prompt_generator, instrumentation, generation_budget, prompt_pack)
 
     print(f"Using model: {args.model}")
-    print(f"Using strategy: {args.strategy}")
-    print(f"Using dataset: {args.dataset}")
+    print(f"Using strategy: {strategy}")
+    print(f"Using dataset: {dataset_name}")
     print(f"Using few-shot dataset: {args.fewshot_dataset}")
+    print(f"Using few-shot selection: {args.fewshot_selection}")
+    if prompt_pack is not None:
+        print(f"Using prompt pack: {prompt_pack.content_hash()[:16]}")
     print(f"Using output file: {args.output_file}")
 
-    answers = model.get_answers_and_cache(dataset)
-    if args.model == "baseline":
-        postprocessed = postprocess_all_baseline(answers, dataset)
-        results = evaluate_baseline(postprocessed)
+    if args.pipeline:
+        # Postprocess and score finished entries in the background while generation continues.
+        pipeline = ScoringPipeline(dataset, baseline=args.model == "baseline", workers=args.pipeline_workers, instrumentation=instrumentation).start()
+        model.get_answers_and_cache(dataset, on_answer=pipeline.submit)
+        results = pipeline.finish()
+    elif args.model == "baseline":
+        answers = model.get_answers_and_cache(dataset)
+        with instrumentation.stage("postprocessing"):
+            postprocessed = postprocess_all_baseline(answers, dataset)
+        with instrumentation.stage("scoring"):
+            results = evaluate_baseline(postprocessed)
     else:
-        postprocessed = postprocess_all(answers, dataset)
-        results = evaluate_all(postprocessed)
+        answers = model.get_answers_and_cache(dataset)
+        with instrumentation.stage("postprocessing"):
+            postprocessed = postprocess_all(answers, dataset)
+        with instrumentation.stage("scoring"):
+            results = evaluate_all(postprocessed)
 
     output_str = f"""
 
     Evaluation done. Results:
     - Model: {args.model}
-    - Dataset: {args.dataset}
-    - Strategy: {args.strategy}
+    - Dataset: {dataset_name}
+    - Strategy: {strategy}
 
     RESULT SUMMARY:
     - Total questions: {len(list(results.keys()))}
@@ -63,10 +92,116 @@ def main():
 
     print(output_str)
 
-    with open(f"results/{args.output_file}_{args.model}_{args.strategy}_{args.dataset}_{datetime.now().strftime('%y%m%d-%H%M%S')}.json", "w") as f:
+    results_file = f"results/{run_name}.json"
+    with open(results_file, "w") as f:
         json.dump(results, f, indent=4)
 
     print("Results written to file.")
 
+    run_info = {"model": args.model, "strategy": strategy, "dataset": dataset_name, "fewshot_selection": args.fewshot_selection, "seed": args.seed, "results_file": results_file}
+    if prompt_pack is not None:
+        run_info["prompt_pack"] = prompt_pack.content_hash()
+    if generation_budget is not None:
+        run_info["generation_budget"] = generation_budget.to_dict()
+    instrumentation.write_json(results_file.replace(".json", ".metrics.json"), run_info)
+    if prometheus_file is not None:
+        instrumentation.write_prometheus(prometheus_file, {"model": args.model, "strategy": strategy, "dataset": dataset_name})
+    generation_summary = instrumentation.summary()["generation"]
+    print(f"Generated {generation_summary['output_tokens']} tokens in {generation_summary['seconds']:.1f}s ({generation_summary['output_tokens_per_second']:.1f} tokens/s).")
+    counters = instrumentation.counters
+    print(f"Answers cut off at the token limit: {counters.get('truncated_answers', 0)}, of which by the generation budget: {counters.get('budget_truncated_answers', 0)}.")
+    print("Run metrics written to file.")
+    return results_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process model and dataset flags.")
+    parser.add_argument('--model', type=str, help='Model to use. Possible options: ' + ', '.join(AbstractModel.registered_models) + '.')
+    parser.add_argument('--dataset', type=str, nargs='+', help='Dataset(s) to use. Possible options: ' + ', '.join(DatasetLoader.registered_datasets) + '.')
+    parser.add_argument('--fewshot-dataset', type=str, help='Dataset to use to collect few-shot examples. Possible options: ' + ', '.join(DatasetLoader.registered_datasets) + '.', default="morehopqa")
+    parser.add_argument('--strategy', type=str, nargs='+', help="Prompting strategy or strategies to use. Possible options: " + ", ".join(PromptGenerator.registered_strategies))
+    parser.add_argument('--sweep-config', type=str, help='JSON file with lists of "strategies" and "datasets" (and optionally "fewshot_dataset") to run instead of --strategy and --dataset.', default=None)
+    parser.add_argument('--fewshot-selection', type=str, help='How few-shot examples are chosen. Possible options: ' + ', '.join(PromptGenerator.fewshot_selections) + '. Default: random', default="random")
+    parser.add_argument('--seed', type=int, help=f'Seed of the random state at the start of every run, which selects the few-shot examples. Default: {DEFAULT_SEED}', default=DEFAULT_SEED)
+    parser.add_argument('--prompt-packs', action='store_true', help='Read the prompts of every run from its prompt pack under models/prompt_packs (see build_prompts.py), building missing packs first. All models reading a pack get identical prompts; only the chat template differs.')
+    parser.add_argument('--output_file', type=str, help='First part of the name of the output file. Will also include model, strategy, dataset and timestamp. Default: output', default="output")
+    parser.add_argument('--batch-tokens', type=int, help='Local models only: generate prompts in length buckets of at most this many padded tokens per batch (prompt plus generated tokens). Default: one prompt at a time.', default=None)
+    parser.add_argument('--device', type=str, help='Local models only: device to run on. Possible options: cuda, cpu. Default: cuda', default=None)
+    parser.add_argument('--quantize', type=str, help='Local models on cpu only: dynamically quantize linear layers. Possible options: int8.', default=None)
+    parser.add_argument('--threads', type=int, help='Local models on cpu only: number of intra-op threads.', default=None)
+    parser.add_argument('--greedy', action='store_true', help='Local models only: use greedy decoding instead of sampling.')
+    parser.add_argument('--num-samples', type=int, help='Sample this many answers per prompt from one generate call (num_return_sequences, or n for OpenAI models). The extracted prediction of every case is the majority vote over the samples.', default=None)
+    parser.add_argument('--model-path', type=str, help='Local models only: load the weights and tokenizer from this path or hub id instead, e.g. a tiny model for a cpu smoke run.', default=None)
+    parser.add_argument('--draft-model-path', type=str, help='llama-70b-assisted only: path or hub id of the draft model. Default: meta-llama/Meta-Llama-3-8B-Instruct', default=None)
+    parser.add_argument('--verify-every', type=int, help='llama-70b-assisted only: also generate every n-th prompt without the draft model, to measure the speedup and compare the outputs.', default=None)
+    parser.add_argument('--token-cache', action='store_true', help='Local models only: keep tokenized prompts in a memory-mapped cache under models/token_cache, reused by later runs.')
+    parser.add_argument('--dedup-prompts', action='store_true', help='Generate identical prompts of a run (e.g. subquestions shared by sibling questions) only once and reuse the answer.')
+    parser.add_argument('--base-url', type=str, help='openai-compatible only: base URL of the server. Default: $OPENAI_COMPATIBLE_BASE_URL or http://localhost:8000/v1', default=None)
+    parser.add_argument('--served-model', type=str, help='openai-compatible only: model id on the server. Default: first model listed by the server.', default=None)
+    parser.add_argument('--concurrency', type=int, help='openai-compatible only: number of requests kept in flight. Default: 32', default=None)
+    parser.add_argument('--pipeline', action='store_true', help='Postprocess and score answers in background workers while generation continues, and report running metrics.')
+    parser.add_argument('--pipeline-workers', type=int, help='Number of postprocessing and scoring workers with --pipeline. Default: 1', default=1)
+    parser.add_argument('--adaptive-budget', action='store_true', help='Limit the generated tokens per case and answer type to a percentile of the lengths of earlier cached answers of the same model and strategy, plus a margin. Answers cut off by this budget are counted in the run metrics.')
+    parser.add_argument('--budget-percentile', type=float, help='Percentile of earlier answer lengths used with --adaptive-budget. Default: 99', default=99)
+    parser.add_argument('--dry-run', action='store_true', help='Only render and tokenize all prompts, and print the estimated tokens, generation hours and API cost of every run. Loads no model weights and makes no API calls.')
+    parser.add_argument('--prometheus-file', type=str, help='Optional path of a Prometheus textfile to export the run metrics to. With several runs, strategy and dataset are added to the file name.', default=None)
+
+    args = parser.parse_args()
+
+    if args.sweep_config is not None:
+        config = load_sweep_config(args.sweep_config)
+        args.strategy = config["strategies"]
+        args.dataset = config["datasets"]
+        args.fewshot_dataset = config.get("fewshot_dataset", args.fewshot_dataset)
+
+    if args.model is None or args.dataset is None or args.strategy is None:
+        print("Missing arguments. Here are the possible options:")
+        print("For --model: " + ", ".join(AbstractModel.registered_models))
+        print("For --dataset: " + ", ".join(DatasetLoader.registered_datasets))
+        print("For --strategy: " + ", ".join(PromptGenerator.registered_strategies))
+        sys.exit(1)
+    for strategy in args.strategy:
+        if strategy not in PromptGenerator.registered_strategies:
+            raise ValueError(f"Strategy {strategy} not found.")
+
+    cells = [(dataset_name, strategy) for dataset_name in args.dataset for strategy in args.strategy]
+    instrumentation = Instrumentation()
+    loaded_datasets = dict()
+    with instrumentation.stage("dataset_load"):
+        for dataset_name in set(args.dataset + [args.fewshot_dataset]):
+            loaded_datasets[dataset_name] = DatasetLoader.create(dataset_name)
+    fewshot_dataset = loaded_datasets[args.fewshot_dataset]
+
+    model_kwargs = dict()
+    if args.batch_tokens is not None:
+        model_kwargs["max_batch_tokens"] = args.batch_tokens
+    if args.token_cache:
+        model_kwargs["token_cache"] = True
+    if args.dedup_prompts:
+        model_kwargs["dedup_prompts"] = True
+    if args.greedy:
+        model_kwargs["greedy"] = True
+    if args.dry_run:
+        model_kwargs["dry_run"] = True
+    for option in ["device", "quantize", "threads", "num_samples", "model_path", "draft_model_path", "verify_every", "base_url", "served_model", "concurrency"]:
+        if getattr(args, option) is not None:
+            model_kwargs[option] = getattr(args, option)
+    with instrumentation.stage("model_load"):
+        model = AbstractModel.create(args.model, args.output_file, PromptGenerator.create(args.strategy[0], fewshot_dataset), instrumentation, **model_kwargs)
+
+    if args.dry_run:
+        print(format_budget(plan_budget(model, args.model, cells, loaded_datasets, fewshot_dataset, args.fewshot_selection, args.seed)))
+        return
+
+    for i, (dataset_name, strategy) in enumerate(cells):
+        if len(cells) > 1:
+            print(f"Run {i + 1}/{len(cells)}: {strategy} on {dataset_name}")
+        # The first run also reports the time spent loading the datasets and the model.
+        cell_instrumentation = instrumentation if i == 0 else Instrumentation()
+        prometheus_file = args.prometheus_file
+        if prometheus_file is not None and len(cells) > 1:
+            prometheus_file = prometheus_file.replace(".prom", "") + f"_{strategy}_{dataset_name}.prom"
+        run_cell(model, args, dataset_name, loaded_datasets[dataset_name], strategy, fewshot_dataset, cell_instrumentation, prometheus_file)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
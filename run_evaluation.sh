@@ -1,10 +1,6 @@
 #!/bin/bash
 
-models=("mistral-7b" "gemma-7b", "llama-8b", "llama-70b", "gpt-4-turbo-direct", "baseline")
-strategies=("zeroshot" "2-shot" "3-shot" "zeroshot-cot" "2-shot-cot" "3-shot-cot")
-
-for model in "${models[@]}"; do
-    for strategy in "${strategies[@]}"; do
-        python3 run_evaluation.py --model $model --dataset morehopqa --fewshot-dataset morehopqa --output_file final --strategy $strategy
-    done
-done
\ No newline at end of file
+# Runs all models and strategies of the paper, see sweeps/final.json. Cells that already have results are skipped,
+# and runs are spread over the available GPUs by memory. Extra arguments are passed on to run_evaluation.py,
+# e.g. ./run_evaluation.sh --dry-run to print the budget of the remaining cells first.
+python3 sweep.py sweeps/final.json "$@"
@@ -0,0 +1,213 @@
+"""Summarize evaluation results
+
+Format: python3 summarize.py --results-dir results --by answer_type --format latex
+
+Indexes the per-entry scores of all results files into a SQLite table once. Later calls only read results files
+that are new or changed, so the paper tables and per-case breakdowns are produced from the index in well under a second.
+"""
+import argparse
+import functools
+import glob
+import json
+import os
+import sqlite3
+import numpy as np
+from models.prompt_generator import PromptGenerator
+from results_names import parse_results_name
+
+INDEX_FILE = "index.sqlite"
+CASE_NUMBERS = [1, 2, 3, 4, 5, 6]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE,
+    mtime REAL,
+    size INTEGER,
+    output_file TEXT,
+    model TEXT,
+    strategy TEXT,
+    dataset TEXT,
+    timestamp TEXT
+);
+CREATE TABLE IF NOT EXISTS scores (
+    file_id INTEGER,
+    _id TEXT,
+    answer_type TEXT,
+    previous_answer_type TEXT,
+    case_number INTEGER,
+    em INTEGER,
+    f1 REAL,
+    precision REAL,
+    recall REAL
+);
+CREATE INDEX IF NOT EXISTS scores_file_id ON scores (file_id);
+"""
+
+
+def score_rows(file_id, results):
+    rows = []
+    for entry in results.values():
+        for case_number in CASE_NUMBERS:
+            case_id = f"case_{case_number}"
+            if f"{case_id}_em" not in entry:
+                continue
+            rows.append((file_id, entry["_id"], entry.get("answer_type"), entry.get("previous_answer_type"), case_number,
+                         int(entry[f"{case_id}_em"]), entry[f"{case_id}_f1"], entry[f"{case_id}_precision"], entry[f"{case_id}_recall"]))
+    return rows
+
+
+def index_results(results_dir="results", index_path=None):
+    """Add new or changed results files in results_dir to the index and drop deleted ones.
+
+    Returns: open connection to the index."""
+    index_path = index_path if index_path is not None else os.path.join(results_dir, INDEX_FILE)
+    connection = sqlite3.connect(index_path)
+    connection.executescript(SCHEMA)
+    indexed = {path: (file_id, mtime, size) for file_id, path, mtime, size in connection.execute("SELECT id, path, mtime, size FROM files")}
+
+    paths = [path for path in sorted(glob.glob(os.path.join(results_dir, "*.json"))) if not path.endswith(".metrics.json")]
+    for path in set(indexed.keys()) - set(paths):
+        connection.execute("DELETE FROM scores WHERE file_id = ?", (indexed[path][0],))
+        connection.execute("DELETE FROM files WHERE id = ?", (indexed[path][0],))
+
+    for path in paths:
+        name_parts = parse_results_name(path)
+        if name_parts is None:
+            continue
+        stat = os.stat(path)
+        if path in indexed:
+            file_id, mtime, size = indexed[path]
+            if mtime == stat.st_mtime and size == stat.st_size:
+                continue
+            connection.execute("DELETE FROM scores WHERE file_id = ?", (file_id,))
+            connection.execute("DELETE FROM files WHERE id = ?", (file_id,))
+        with open(path, "r") as f:
+            results = json.load(f)
+        cursor = connection.execute(
+            "INSERT INTO files (path, mtime, size, output_file, model, strategy, dataset, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, stat.st_mtime, stat.st_size, name_parts["output_file"], name_parts["model"], name_parts["strategy"], name_parts["dataset"], name_parts["timestamp"]))
+        connection.executemany("INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", score_rows(cursor.lastrowid, results))
+    connection.commit()
+    return connection
+
+
+def select_files(connection, output_file=None, all_runs=False):
+    """Return the indexed files as dicts. Unless all_runs, only the latest run of every (model, strategy, dataset) is kept."""
+    query = "SELECT id, path, output_file, model, strategy, dataset, timestamp FROM files"
+    parameters = ()
+    if output_file is not None:
+        query += " WHERE output_file = ?"
+        parameters = (output_file,)
+    files = [dict(zip(["id", "path", "output_file", "model", "strategy", "dataset", "timestamp"], row)) for row in connection.execute(query + " ORDER BY path", parameters)]
+    if all_runs:
+        return files
+    latest = dict()
+    for file in files:
+        key = (file["model"], file["strategy"], file["dataset"])
+        if key not in latest or (file["timestamp"] or "") >= (latest[key]["timestamp"] or ""):
+            latest[key] = file
+    return sorted(latest.values(), key=lambda file: (file["model"], PromptGenerator.registered_strategies.index(file["strategy"]), file["dataset"] or ""))
+
+
+@functools.lru_cache(maxsize=16)
+def bootstrap_weights(n, num_bootstrap=1000, seed=42):
+    """How often each of n entries is drawn in every bootstrap resample (num_bootstrap x n). The draws only depend on
+    n and the seed, so they are made once and shared by all files with the same number of entries."""
+    rng = np.random.default_rng(seed)
+    draws = rng.integers(0, n, size=(num_bootstrap, n))
+    return np.bincount((draws + n * np.arange(num_bootstrap)[:, None]).ravel(), minlength=num_bootstrap * n).reshape(num_bootstrap, n).astype(float)
+
+
+def bootstrap_margins(values, present, num_bootstrap=1000, confidence=0.95, seed=42):
+    """Half-widths of the bootstrap confidence intervals of the column means of values (entries x columns), as the
+    larger distance of the mean to either bound. As in bootstrap_confidence_interval of the notebook, the entries are
+    resampled once and every resample is used for all columns. present marks the entries with a value in a column."""
+    if len(values) == 0 or num_bootstrap == 0:
+        return np.zeros(values.shape[1])
+    weights = bootstrap_weights(len(values), num_bootstrap, seed)
+    samples = (weights @ values) / np.maximum(weights @ present, 1)
+    lower, upper = np.quantile(samples, [(1 - confidence) / 2, 1 - (1 - confidence) / 2], axis=0)
+    mean = values.sum(axis=0) / np.maximum(present.sum(axis=0), 1)
+    return np.maximum(np.abs(mean - lower), np.abs(upper - mean))
+
+
+def summarize(connection, files, by=None, num_bootstrap=1000):
+    """EM and F1 (in %) with bootstrap margins per file and case, optionally broken down by answer_type or previous_answer_type.
+
+    Returns: list of rows, each a dict with the file info, the group and a dict of case number -> metrics."""
+    if by not in [None, "answer_type", "previous_answer_type"]:
+        raise ValueError(f"Cannot group by {by}. Possible options: answer_type, previous_answer_type.")
+    rows = []
+    for file in files:
+        query = f"SELECT _id, case_number, em, f1, {by if by is not None else 'NULL'} FROM scores WHERE file_id = ?"
+        data = connection.execute(query, (file["id"],)).fetchall()
+        ids, case_numbers, em, f1, entry_groups = [np.array(column) for column in zip(*data)] if data else [np.zeros(0)] * 5
+        groups = [None] if by is None else sorted(set(entry_groups.tolist()), key=str)
+        for group in groups:
+            row = {"model": file["model"], "strategy": file["strategy"], "dataset": file["dataset"], "path": file["path"], "group": group, "cases": dict()}
+            mask = np.ones(len(ids), dtype=bool) if group is None else entry_groups == group
+            # One row per entry with the EM and F1 columns of all cases (zero where a case is missing),
+            # so all cases share the bootstrap resamples.
+            _, entry_rows = np.unique(ids[mask], return_inverse=True)
+            columns = 2 * (case_numbers[mask].astype(int) - CASE_NUMBERS[0])
+            values = np.zeros((entry_rows.max() + 1 if len(entry_rows) else 0, 2 * len(CASE_NUMBERS)))
+            present = np.zeros_like(values)
+            values[entry_rows, columns] = em[mask].astype(float) * 100
+            values[entry_rows, columns + 1] = f1[mask].astype(float) * 100
+            present[entry_rows, columns] = present[entry_rows, columns + 1] = 1
+            margins = bootstrap_margins(values, present, num_bootstrap)
+            counts = present.sum(axis=0)
+            for i, case_number in enumerate(CASE_NUMBERS):
+                if counts[2 * i] == 0:
+                    continue
+                row["cases"][case_number] = {"n": int(counts[2 * i]), "em": values[:, 2 * i].sum() / counts[2 * i], "em_pm": margins[2 * i],
+                                             "f1": values[:, 2 * i + 1].sum() / counts[2 * i], "f1_pm": margins[2 * i + 1]}
+            rows.append(row)
+    return rows
+
+
+def format_table(rows, table_format="text"):
+    """Format summary rows as a text grid, LaTeX table rows (like the paper) or CSV."""
+    def cell(metrics, metric):
+        if metrics is None:
+            return "-"
+        if table_format == "latex":
+            return f"{metrics[metric]:.2f}" + "$_{\\pm" + f"{metrics[metric + '_pm']:.2f}" + "}$"
+        if table_format == "csv":
+            return f"{metrics[metric]:.2f}"
+        return f"{metrics[metric]:.2f}±{metrics[metric + '_pm']:.2f}"
+
+    header = ["model", "strategy", "dataset", "group", "n"] + [f"case_{case_number}_{metric}" for case_number in CASE_NUMBERS for metric in ["em", "f1"]]
+    lines = []
+    for row in rows:
+        n = max([metrics["n"] for metrics in row["cases"].values()], default=0)
+        cells = [row["model"], row["strategy"], row["dataset"] or "-", row["group"] or "-", str(n)]
+        cells += [cell(row["cases"].get(case_number), metric) for case_number in CASE_NUMBERS for metric in ["em", "f1"]]
+        lines.append(cells)
+
+    if table_format == "csv":
+        return "\n".join(",".join(cells) for cells in [header] + lines)
+    if table_format == "latex":
+        return "\n".join(" & ".join(cells) + " \\\\" for cells in [header] + lines)
+    widths = [max(len(cells[i]) for cells in [header] + lines) for i in range(len(header))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(cells, widths)) for cells in [header] + lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize all results files into per-case EM/F1 tables.")
+    parser.add_argument('--results-dir', type=str, help='Directory with the results files. Default: results', default="results")
+    parser.add_argument('--output_file', type=str, help='Only include results whose name starts with this output file name, e.g. final.', default=None)
+    parser.add_argument('--by', type=str, help='Break the results down by answer_type or previous_answer_type.', default=None)
+    parser.add_argument('--all-runs', action='store_true', help='Show every results file instead of only the latest run per model, strategy and dataset.')
+    parser.add_argument('--bootstrap', type=int, help='Number of bootstrap samples for the confidence intervals, 0 to disable. Default: 1000', default=1000)
+    parser.add_argument('--format', type=str, help='Table format. Possible options: text, latex, csv. Default: text', default="text")
+    args = parser.parse_args()
+
+    connection = index_results(args.results_dir)
+    files = select_files(connection, args.output_file, args.all_runs)
+    rows = summarize(connection, files, args.by, args.bootstrap)
+    print(format_table(rows, args.format))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+"""Run a sweep of evaluations on a pool of devices
+
+Format: python3 sweep.py sweeps/final.json [additional arguments for run_evaluation.py]
+
+Reads a grid of models, strategies and datasets from a JSON config and runs every cell that has no results file yet.
+The cells of a model run in one run_evaluation.py process, so its weights are loaded once. Processes are started as
+soon as enough device memory is free, so small models share devices while a large model occupies others. Failed
+processes are retried for their remaining cells. Cells whose answers are completely cached but not scored are re-scored
+with rescore.py instead of being generated again.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datasets.abstract_dataset_loader import DatasetLoader
+from results_names import parse_results_name
+
+# Device memory (GB) needed per model, with bf16 weights and room for the KV cache. API models need no device.
+MEMORY_GB = {
+    "gemma-7b": 24,
+    "llama-8b": 20,
+    "mistral-7b": 20,
+    "baseline": 20,
+    "llama-70b": 150,
+    "llama-70b-assisted": 170,
+}
+LOG_DIR = "results/sweep_logs"
+
+
+def load_grid(path):
+    """Load a grid config: lists of "models", "strategies" and "datasets", and optionally "fewshot_dataset", "output_file",
+    "devices" (list of {"name", "memory_gb"}), "memory_gb" (per model), "args" (for all runs), "model_args" (per model),
+    "max_retries" and "prompt_packs" (render the prompts once with build_prompts.py and let all runs read them)."""
+    with open(path, "r") as f:
+        grid = json.load(f)
+    for key in ["models", "strategies", "datasets"]:
+        if not isinstance(grid.get(key), list):
+            raise ValueError(f"Grid config {path} must contain a list of {key}.")
+    grid.setdefault("fewshot_dataset", "morehopqa")
+    grid.setdefault("output_file", "output")
+    grid.setdefault("args", [])
+    grid.setdefault("model_args", dict())
+    grid.setdefault("max_retries", 2)
+    grid.setdefault("prompt_packs", False)
+    grid["memory_gb"] = dict(MEMORY_GB, **grid.get("memory_gb", dict()))
+    return grid
+
+
+def detect_devices():
+    """GPUs reported by nvidia-smi as a list of {"name", "memory_gb"}, or an empty list without nvidia-smi."""
+    try:
+        output = subprocess.run(["nvidia-smi", "--query-gpu=index,memory.total", "--format=csv,noheader,nounits"], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    devices = []
+    for line in output.strip().splitlines():
+        index, memory_mb = [value.strip() for value in line.split(",")]
+        devices.append({"name": index, "memory_gb": int(memory_mb) / 1024})
+    return devices
+
+
+def find_runs(directory, output_file):
+    """Files of earlier runs in directory with the given output file name, per (model, strategy, dataset) cell, latest last."""
+    runs = dict()
+    if not os.path.isdir(directory):
+        return runs
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".json") or file_name.endswith(".metrics.json"):
+            continue
+        name_parts = parse_results_name(file_name)
+        if name_parts is None or name_parts["output_file"] != output_file:
+            continue
+        runs.setdefault((name_parts["model"], name_parts["strategy"], name_parts["dataset"]), []).append(os.path.join(directory, file_name))
+    for paths in runs.values():
+        paths.sort(key=lambda path: parse_results_name(path)["timestamp"] or "")
+    return runs
+
+
+def cell_status(grid, results_dir="results", cache_dir="models/cached_answers"):
+    """Split the cells of the grid into completed cells (with a results file), cells whose latest cached answers are
+    complete but not scored (mapped to that cache file) and pending cells."""
+    results = find_runs(results_dir, grid["output_file"])
+    caches = find_runs(cache_dir, grid["output_file"])
+    completed, unscored, pending = [], dict(), []
+    for model in grid["models"]:
+        for dataset_name in grid["datasets"]:
+            for strategy in grid["strategies"]:
+                cell = (model, strategy, dataset_name)
+                if cell in results:
+                    completed.append(cell)
+                    continue
+                if cell in caches:
+                    with open(caches[cell][-1], "r") as f:
+                        cached = json.load(f)
+                    if len(cached) == DatasetLoader.create(dataset_name).length:
+                        unscored[cell] = caches[cell][-1]
+                        continue
+                pending.append(cell)
+    return completed, unscored, pending
+
+
+class Job:
+    def __init__(self, kind, model, cells, memory_gb, command, attempt=1):
+        # Either "run" (run_evaluation.py) or "rescore" (rescore.py).
+        self.kind = kind
+        self.model = model
+        self.cells = cells
+        self.memory_gb = memory_gb
+        self.command = command
+        self.attempt = attempt
+        self.process = None
+        self.allocation = dict()
+        self.started_at = None
+
+    def describe(self):
+        devices = ",".join(self.allocation.keys()) or "no device"
+        return f"{self.kind} {self.model} ({len(self.cells)} cells, attempt {self.attempt}) on {devices}"
+
+
+def make_jobs(grid, unscored, pending, extra_args, attempt=1):
+    """One rescore job per unscored cell and one run_evaluation.py job per model with pending cells.
+    If the pending strategies differ between datasets, the model gets one job per dataset."""
+    jobs = []
+    for (model, strategy, dataset_name), cache_path in unscored.items():
+        jobs.append(Job("rescore", model, [(model, strategy, dataset_name)], 0, [sys.executable, "rescore.py", cache_path, "--dataset", dataset_name], attempt))
+    for model in grid["models"]:
+        model_cells = [cell for cell in pending if cell[0] == model]
+        if not model_cells:
+            continue
+        strategies = {dataset_name: [strategy for _, strategy, cell_dataset in model_cells if cell_dataset == dataset_name] for dataset_name in grid["datasets"]}
+        strategies = {dataset_name: dataset_strategies for dataset_name, dataset_strategies in strategies.items() if dataset_strategies}
+        if len(set(tuple(dataset_strategies) for dataset_strategies in strategies.values())) == 1:
+            groups = [(list(strategies.keys()), next(iter(strategies.values())))]
+        else:
+            groups = [([dataset_name], dataset_strategies) for dataset_name, dataset_strategies in strategies.items()]
+        for datasets, group_strategies in groups:
+            command = [sys.executable, "run_evaluation.py", "--model", model, "--dataset"] + datasets + ["--strategy"] + group_strategies
+            command += ["--fewshot-dataset", grid["fewshot_dataset"], "--output_file", grid["output_file"]]
+            if grid["prompt_packs"]:
+                command.append("--prompt-packs")
+            command += grid["args"] + grid["model_args"].get(model, []) + extra_args
+            cells = [(model, strategy, dataset_name) for dataset_name in datasets for strategy in group_strategies]
+            jobs.append(Job("run", model, cells, grid["memory_gb"].get(model, 0), command, attempt))
+    return jobs
+
+
+def build_prompt_packs(grid, pending, extra_args):
+    """Render the prompt packs of all pending cells before the runs start, so no two runs build the same pack."""
+    cells = [(strategy, dataset_name) for model, strategy, dataset_name in pending if model != "baseline"]
+    if not cells:
+        return
+    strategies = sorted(set(strategy for strategy, _ in cells))
+    datasets = sorted(set(dataset_name for _, dataset_name in cells))
+    command = [sys.executable, "build_prompts.py", "--dataset"] + datasets + ["--strategy"] + strategies + ["--fewshot-dataset", grid["fewshot_dataset"]]
+    subprocess.run(command + grid["args"] + extra_args, check=True)
+
+
+class DevicePool:
+    def __init__(self, devices):
+        self.total = {device["name"]: device["memory_gb"] for device in devices}
+        self.free = dict(self.total)
+
+    def allocate(self, memory_gb):
+        """Reserve memory_gb on the device with the least free memory that fits it, or else on several completely
+        free devices (e.g. for a model sharded with device_map="auto").
+
+        Returns: dict of device name -> reserved GB, or None if the memory is not available now."""
+        if memory_gb == 0:
+            return dict()
+        fitting = [name for name, free in self.free.items() if free >= memory_gb]
+        if fitting:
+            name = min(fitting, key=lambda name: self.free[name])
+            self.free[name] -= memory_gb
+            return {name: memory_gb}
+        idle = sorted([name for name in self.free if self.free[name] == self.total[name]], key=lambda name: -self.total[name])
+        allocation = dict()
+        for name in idle:
+            if sum(allocation.values()) >= memory_gb:
+                break
+            allocation[name] = self.free[name]
+        if sum(allocation.values()) < memory_gb:
+            return None
+        for name in allocation:
+            self.free[name] = 0
+        return allocation
+
+    def release(self, allocation):
+        for name, memory_gb in allocation.items():
+            self.free[name] += memory_gb
+
+    def fits_ever(self, memory_gb):
+        return memory_gb <= sum(self.total.values())
+
+
+def run_sweep(grid, extra_args=None, poll_interval=5.0):
+    """Run all cells of the grid without results.
+
+    Returns: list of cells that are still missing at the end."""
+    extra_args = extra_args or []
+    devices = grid.get("devices") or detect_devices()
+    pool = DevicePool(devices)
+    completed, unscored, pending = cell_status(grid)
+    total_cells = len(completed) + len(unscored) + len(pending)
+    print(f"Sweep: {total_cells} cells, {len(completed)} with results, {len(unscored)} to re-score, {len(pending)} to run on {len(devices)} devices ({', '.join(f'{name}: {memory:.0f} GB' for name, memory in pool.total.items()) or 'none'}).")
+
+    if grid["prompt_packs"]:
+        build_prompt_packs(grid, pending, extra_args)
+    queue = sorted(make_jobs(grid, unscored, pending, extra_args), key=lambda job: -job.memory_gb)
+    running = []
+    failed_cells = []
+    os.makedirs(LOG_DIR, exist_ok=True)
+    start = time.time()
+    started = 0
+
+    def report(event):
+        done = len(cell_status(grid)[0])
+        print(f"[{time.time() - start:7.0f}s] {done}/{total_cells} cells done, {len(running)} running, {len(queue)} queued, {len(failed_cells)} failed | {event}")
+
+    for job in list(queue):
+        if not pool.fits_ever(job.memory_gb):
+            queue.remove(job)
+            failed_cells += job.cells
+            report(f"cannot run {job.model}: needs {job.memory_gb} GB, the devices have {sum(pool.total.values()):.0f} GB")
+
+    try:
+        while queue or running:
+            for job in list(queue):
+                allocation = pool.allocate(job.memory_gb)
+                if allocation is None:
+                    continue
+                queue.remove(job)
+                job.allocation = allocation
+                environment = dict(os.environ)
+                if job.memory_gb > 0:
+                    environment["CUDA_VISIBLE_DEVICES"] = ",".join(allocation.keys())
+                started += 1
+                log_path = os.path.join(LOG_DIR, f"{grid['output_file']}_{time.strftime('%y%m%d-%H%M%S', time.localtime(start))}_{started:03d}_{job.kind}_{job.model}_attempt{job.attempt}.log")
+                with open(log_path, "w") as log:
+                    job.process = subprocess.Popen(job.command, stdout=log, stderr=subprocess.STDOUT, env=environment)
+                job.started_at = time.time()
+                running.append(job)
+                report(f"started {job.describe()}, log: {log_path}")
+
+            for job in list(running):
+                return_code = job.process.poll()
+                if return_code is None:
+                    continue
+                running.remove(job)
+                pool.release(job.allocation)
+                if return_code == 0:
+                    report(f"finished {job.describe()} in {time.time() - job.started_at:.0f}s")
+                    continue
+                # Only the cells of the job that are still missing are run again.
+                _, unscored, pending = cell_status(grid)
+                remaining_unscored = {cell: path for cell, path in unscored.items() if cell in job.cells}
+                remaining = [cell for cell in pending if cell in job.cells]
+                if job.attempt <= grid["max_retries"]:
+                    retries = make_jobs(grid, remaining_unscored, remaining, extra_args, job.attempt + 1)
+                    queue = sorted(queue + retries, key=lambda queued: -queued.memory_gb)
+                    report(f"failed {job.describe()} with exit code {return_code}, retrying {len(remaining) + len(remaining_unscored)} cells")
+                else:
+                    failed_cells += remaining + list(remaining_unscored.keys())
+                    report(f"failed {job.describe()} with exit code {return_code}, giving up")
+            time.sleep(poll_interval if running else 0)
+    except KeyboardInterrupt:
+        for job in running:
+            job.process.terminate()
+        raise
+
+    completed, unscored, pending = cell_status(grid)
+    missing = list(unscored.keys()) + pending
+    print(f"Sweep done in {time.time() - start:.0f}s: {len(completed)}/{total_cells} cells with results.")
+    for model, strategy, dataset_name in missing:
+        print(f"Missing: {model} {strategy} {dataset_name}")
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every cell of a grid of models, strategies and datasets that has no results yet, packing runs onto the available devices by memory.")
+    parser.add_argument('config', type=str, help='Grid config, e.g. sweeps/final.json')
+    parser.add_argument('--status', action='store_true', help='Only print which cells have results, can be re-scored or still have to run.')
+    parser.add_argument('--poll-interval', type=float, help='Seconds between checks of the running processes. Default: 5', default=5.0)
+    args, extra_args = parser.parse_known_args()
+
+    grid = load_grid(args.config)
+    if "--dry-run" in extra_args:
+        # Budget estimates load no weights, so they run one after the other and print to the terminal.
+        _, _, pending = cell_status(grid)
+        for job in make_jobs(grid, dict(), pending, extra_args):
+            subprocess.run(job.command, check=True)
+        return
+    if args.status:
+        completed, unscored, pending = cell_status(grid)
+        for label, cells in [("done", completed), ("re-score", list(unscored.keys())), ("pending", pending)]:
+            for model, strategy, dataset_name in cells:
+                print(f"{label:8}  {model}  {strategy}  {dataset_name}")
+        return
+    missing = run_sweep(grid, extra_args, args.poll_interval)
+    sys.exit(1 if missing else 0)
+
+if __name__ == '__main__':
+    main()